@@ -0,0 +1,118 @@
+"""
+Admission control in front of the printer.
+
+The printer manages a few tickets per minute, so one spammy client could
+otherwise fill the backlog for everyone. Two checks run before a job is
+accepted:
+
+  - RateLimiter: a token bucket per client IP (RATE_LIMIT_PER_MIN refill,
+    RATE_LIMIT_BURST capacity)
+  - AdmissionController: caps the number of queued jobs, and once a job is
+    rendered, rejects it when the scheduler's backlog per printer plus the
+    cost model's estimate for the job would exceed ADMISSION_SLO_SEC
+
+Both answer with the number of seconds the client should wait, which the
+app returns as 429 + Retry-After.
+"""
+import math
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from metrics import QUEUE_DEPTH
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("true", "1", "yes")
+RATE_LIMIT_PER_MIN = float(os.getenv("RATE_LIMIT_PER_MIN", "4"))  # Sustained jobs per client per minute
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "3"))  # Jobs a client may send back to back
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))  # Proxies (tunnels) in front of the app
+ADMISSION_SLO_SEC = float(os.getenv("ADMISSION_SLO_SEC", "90"))  # Max acceptable queue wait + print time
+ADMISSION_MAX_DEPTH = int(os.getenv("ADMISSION_MAX_DEPTH", "20"))  # Hard cap on queued jobs
+
+
+class RateLimiter:
+    """Token bucket per client key."""
+
+    def __init__(self, per_minute: float = RATE_LIMIT_PER_MIN, burst: float = RATE_LIMIT_BURST, max_clients: int = 10000):
+        self.rate = per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # key -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def check(self, key: str, now: float = None) -> Optional[float]:
+        """Take a token for `key`. Returns None if allowed, else seconds until one is available."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1.0:
+                self._buckets[key] = (tokens - 1.0, now)
+                allowed = True
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed = False
+            if len(self._buckets) > self.max_clients:
+                self._prune(now)
+        if allowed:
+            return None
+        return (1.0 - tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def _prune(self, now: float):
+        # Drop buckets that have refilled completely; they carry no state
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        for key, (_tokens, last) in list(self._buckets.items()):
+            if now - last >= full_after:
+                del self._buckets[key]
+
+
+class Overloaded(Exception):
+    """A rendered job would finish too late; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("The printer is busy, please try again shortly")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Global queue-depth cap, and a drain-time check against a latency SLO."""
+
+    def __init__(self, slo_sec: float = ADMISSION_SLO_SEC, max_depth: int = ADMISSION_MAX_DEPTH):
+        self.slo_sec = slo_sec
+        self.max_depth = max_depth
+        self.depth = 0
+        self._lock = threading.Lock()
+
+    def try_admit(self) -> Optional[float]:
+        """Reserve a queue slot. Returns None if admitted, else a Retry-After in seconds."""
+        with self._lock:
+            if self.depth >= self.max_depth:
+                # Nothing is rendered yet to estimate from: about one job's share of the SLO
+                return self.slo_sec / max(1, self.max_depth)
+            self.depth += 1
+            QUEUE_DEPTH.set(self.depth)
+        return None
+
+    def release(self):
+        """Free the slot reserved by try_admit."""
+        with self._lock:
+            self.depth = max(0, self.depth - 1)
+            QUEUE_DEPTH.set(self.depth)
+
+    def check_drain(self, backlog_sec: float, estimate_sec: float):
+        """
+        Raise Overloaded if a job estimated at `estimate_sec` would finish past
+        the SLO behind `backlog_sec` of work per printer. A job is always let
+        onto an idle printer, however long it is.
+        """
+        drain = backlog_sec + estimate_sec
+        if backlog_sec > 0 and drain > self.slo_sec:
+            # Wait until enough of the backlog has drained for this job to fit
+            raise Overloaded(max(estimate_sec, drain - self.slo_sec))
+
+
+def retry_after_header(seconds: float) -> str:
+    """Retry-After wants whole seconds."""
+    return str(max(1, math.ceil(seconds)))
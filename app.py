@@ -3,27 +3,52 @@
 Ticket Printing Application for 58mm Thermal Printer
 Supports: usb, serial, network, bluetooth (classic rfcomm), ble (BLE GATT)
 """
-from flask import Flask, request, render_template, jsonify
+from flask import Flask, Response, request, render_template, jsonify
 from flask_cors import CORS
+from collections import OrderedDict
 from datetime import datetime
+import concurrent.futures
+import functools
+import hashlib
 import logging
 import os
 import base64
 import io
+import threading
+import time
 
-from escpos.printer import Usb, Serial, Network
-from PIL import Image
-from ble_printer import ble_print_text, ble_print_text_with_image, ble_is_available, process_image_base64
+from typing import TYPE_CHECKING, Optional
 
 from dotenv import load_dotenv
-load_dotenv()
+load_dotenv()  # Before the local imports below, which read their settings at import time
+
+import job_trace
+import printer_daemon
+from admission import RATE_LIMIT_ENABLED, TRUSTED_PROXY_HOPS, AdmissionController, Overloaded, RateLimiter, retry_after_header
+from metrics import BYTES_SENT, CONTENT_TYPE_LATEST, JOB_SECONDS, REJECTIONS, render_latest
+from escpos_codes import BARCODE_SYMBOLOGIES, barcode, qr_code
+from print_density import adapt_heat
+from print_scheduler import CostModel, PrintJob, PrintScheduler, payload_stats, route_priority
+from printer_drivers import open_printer
+from printer_profile import PROFILE
+from raster_payload import client_settings, decode_raster
+from ticket_archive import open_archive
+from ticket_templates import CLASSIC_IMAGE_HEADER, CLASSIC_TICKET, IMAGE_NOTE_HEADER, PROPHECY_TICKET, RASTER, frame, note_template
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, template_folder='frontend')
-CORS(app)  # Enable CORS for frontend on different domain
+CORS(app, expose_headers=["Retry-After"])  # Enable CORS for frontend on different domain
+if TRUSTED_PROXY_HOPS:
+    # Behind ngrok / Cloudflare Tunnel every request comes from localhost;
+    # take the client IP from X-Forwarded-For so rate limits are per client
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 
 # Configuration
 TEST_MODE = os.getenv("TEST_MODE", "false").lower() == "true"  # Set to 'true' to test without a printer
@@ -33,48 +58,42 @@ USB_VENDOR = int(os.getenv("USB_VENDOR", "0x0416"), 16) if os.getenv("USB_VENDOR
 USB_PRODUCT = int(os.getenv("USB_PRODUCT", "0x5011"), 16) if os.getenv("USB_PRODUCT") else None
 
 SERIAL_PORT = os.getenv("SERIAL_PORT", "/dev/ttyUSB0")
-NETWORK_HOST = os.getenv("NETWORK_HOST", "192.168.1.100")
+NETWORK_HOST = os.getenv("NETWORK_HOST", "192.168.1.100")  # Comma-separated host[:port] for a pool of printers
+NETWORK_PORT = int(os.getenv("NETWORK_PORT", "9100"))
 
-BLE_PRINTER_ADDR = os.getenv("BLE_PRINTER_ADDR", "").strip()
+BLE_PRINTER_ADDR = os.getenv("BLE_PRINTER_ADDR", "").strip()  # Comma-separated for several printers (ADDR[@hciN])
 
+PRINTER_DAEMON_SOCKET = printer_daemon.PRINTER_DAEMON_SOCKET  # Set = print through printer_daemon.py
+PREPARE_CACHE_SIZE = int(os.getenv("PREPARE_CACHE_SIZE", "4"))  # Images decoded by /prepare, kept for the print
+PREPARE_MAX_PENDING = 2  # /prepare image decodes queued or running; more are skipped
 
-def build_ticket_text(from_name: str, question: str) -> str:
+
+def _printer_count() -> int:
+    """How many printers jobs can run on at once (NETWORK_HOST / BLE_PRINTER_ADDR lists)."""
+    if PRINTER_TYPE == "network":
+        return len(NETWORK_HOST.split(","))
+    if PRINTER_TYPE == "ble" and BLE_PRINTER_ADDR:
+        return len(BLE_PRINTER_ADDR.split(","))
+    return 1
+
+
+rate_limiter = RateLimiter()
+prepare_limiter = RateLimiter(per_minute=30, burst=10)  # /prepare is a hint sent while typing, not a job
+admission = AdmissionController()
+archive = open_archive()
+scheduler = PrintScheduler(capacity=_printer_count())  # One job per printer at a time, shortest first
+cost_model = CostModel()
+
+
+def render_ticket(from_name: str, question: str) -> bytes:
+    """Ticket body as ESC/POS bytes, filled into the pre-compiled template."""
     now = datetime.now()
-    time_str = now.strftime("%I:%M %p")
-    date_str = now.strftime("%B %d, %Y")
-
-    # lines = [
-    #     "================================",
-    #     "TICKET",
-    #     "--------------------------------",
-    #     f"From: {from_name}",
-    #     f"Time: {time_str}",
-    #     f"Date: {date_str}",
-    #     "--------------------------------",
-    #     "Question/Comment",
-    #     question.strip(),
-    #     "--------------------------------",
-    #     "================================",
-    # ]
-    lines = [
-        "    .  *  .   *   .  *  .",
-        "  *    ✦ PROPHECY ✦    *",
-        "    .  *  .   *   .  *  .",
-        "",
-        f"  The Oracle speaks for:",
-        f"  ☽ {from_name}",
-        f"  ☆ {time_str} on {date_str}",
-        "",
-        "  ═══════════════════════════",
-        "  The spirits whisper:",
-        "",
-        question.strip(),
-        "",
-        "  ═══════════════════════════",
-        "    ∴ May wisdom guide you ∴",
-        "    .  *  .   *   .  *  .",
-    ]
-    return "\n".join(lines) + "\n"
+    return PROPHECY_TICKET.render(
+        from_name=from_name,
+        time=now.strftime("%I:%M %p"),
+        date=now.strftime("%B %d, %Y"),
+        question=question.strip(),
+    )
 
 
 def format_date_string() -> str:
@@ -91,49 +110,33 @@ def format_date_string() -> str:
     return f"{hour}:{minute}:{second} {ampm} on {month}/{day}/{year}"
 
 
-def build_print_content(content: str, include_separator: bool = True, include_date: bool = True) -> str:
+def render_print_content(content: str, include_separator: bool = True, include_date: bool = True) -> bytes:
     """Build the final print content with optional separator and date"""
-    lines = []
-    
-    if include_separator:
-        lines.append("--------------------------------")
-    
-    if include_date:
-        lines.append(format_date_string())
-        lines.append("")  # blank line after date
-    
-    lines.append(content.strip())
-    lines.append("")  # trailing newline for spacing
-    
-    return "\n".join(lines) + "\n"
+    return note_template(include_separator, include_date).render(
+        date=format_date_string(),
+        content=content.strip(),
+    )
+
+
+class PrinterUnavailable(RuntimeError):
+    """The configured printer could not be opened."""
 
 
 def get_printer():
     """
     Initialize and return an escpos printer object for non-BLE modes.
     IMPORTANT: BLE printing does NOT use this (it doesn't return a device).
+    Only the backend for PRINTER_TYPE is imported (see printer_drivers).
     """
     try:
-        if PRINTER_TYPE == "usb":
-            if USB_VENDOR and USB_PRODUCT:
-                return Usb(USB_VENDOR, USB_PRODUCT)
-            return Usb(0x0416, 0x5011)
-
-        if PRINTER_TYPE == "serial":
-            return Serial(devfile=SERIAL_PORT, baudrate=9600)
-
-        if PRINTER_TYPE == "bluetooth":
-            # Classic Bluetooth SPP via rfcomm (NOT BLE)
-            return Serial(devfile="/dev/rfcomm0", baudrate=9600)
-
-        if PRINTER_TYPE == "network":
-            return Network(NETWORK_HOST)
-
-        if PRINTER_TYPE == "ble":
-            # BLE does not use escpos Serial/Usb objects
-            return None
-
-        raise ValueError(f"Unknown printer type: {PRINTER_TYPE}")
+        return open_printer(
+            PRINTER_TYPE,
+            usb_vendor=USB_VENDOR,
+            usb_product=USB_PRODUCT,
+            serial_port=SERIAL_PORT,
+            network_host=NETWORK_HOST,
+            network_port=NETWORK_PORT,
+        )
 
     except Exception as e:
         logger.error(f"Failed to initialize printer: {e}")
@@ -142,56 +145,250 @@ def get_printer():
         return None
 
 
-def format_ticket_escpos(printer, from_name: str, question: str, image: Image.Image = None) -> bool:
+def _ble():
+    """ble_printer (and with it bleak) is only imported when PRINTER_TYPE=ble."""
+    import ble_printer
+    return ble_printer
+
+
+def _process_image(image_base64: str):
+    """Decode an uploaded image; PIL is only imported once an image is printed."""
+    from escpos_image import process_image_base64
+    return process_image_base64(image_base64)
+
+
+def _instrumented(route: str):
+    """Time the request end to end, labelled with its outcome."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            status = 500
+            with job_trace.job(route) as trace:
+                try:
+                    response = view(*args, **kwargs)
+                    status = response[1] if isinstance(response, tuple) else 200
+                    if status < 400:
+                        outcome = "ok"
+                    elif status < 500:
+                        outcome = "rejected"
+                    return response
+                finally:
+                    elapsed = time.perf_counter() - started
+                    transport = "test" if TEST_MODE else PRINTER_TYPE
+                    JOB_SECONDS.observe(elapsed, route=route, transport=transport, outcome=outcome)
+                    if status != 429:
+                        _archive_job(route, status, elapsed)
+                        job_trace.finish(trace, request.get_json(silent=True), status, elapsed)
+        return wrapper
+    return decorator
+
+
+def _archive_job(route: str, status: int, elapsed: float):
+    """Hand the job to the local archive (written and synced off the request path)."""
+    data = request.get_json(silent=True) or {}
+    if route == "submit_ticket":
+        kind, from_name, content = "ticket", data.get("from_name", "Anonymous"), data.get("question")
+        has_image = bool(data.get("image"))
+    else:
+        kind, from_name = data.get("type", "text"), None
+        has_image = kind in ("image", "raster")
+        content = None if has_image else data.get("content")  # Image bytes stay out of the archive
+    archive.record(route, kind=kind, from_name=from_name, content=content, has_image=has_image,
+                   status=status, duration_ms=round(elapsed * 1000, 1))
+
+
+def _too_many(reason: str, message: str, retry_after: float):
+    REJECTIONS.inc(reason=reason)
+    return (
+        jsonify({"success": False, "error": message, "retry_after": round(retry_after, 1)}),
+        429,
+        {"Retry-After": retry_after_header(retry_after)},
+    )
+
+
+_proxy_warning_logged = False
+
+
+def _client_key() -> str:
+    """The client IP rate limits are kept per."""
+    global _proxy_warning_logged
+    if not TRUSTED_PROXY_HOPS and not _proxy_warning_logged and request.headers.get("X-Forwarded-For"):
+        _proxy_warning_logged = True
+        logger.warning("Requests come through a proxy (X-Forwarded-For) but TRUSTED_PROXY_HOPS=0: all clients "
+                       "share one rate limit. Set TRUSTED_PROXY_HOPS=1 behind ngrok or Cloudflare Tunnel.")
+    return request.remote_addr or "unknown"
+
+
+def _admitted(view):
+    """Per-client rate limit, then global admission control, before a job runs."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if RATE_LIMIT_ENABLED:
+            retry_after = rate_limiter.check(_client_key())
+            if retry_after is not None:
+                return _too_many("rate_limit", "Too many print requests, please slow down", retry_after)
+
+        retry_after = admission.try_admit()
+        if retry_after is not None:
+            return _too_many("overload", "The printer is busy, please try again shortly", retry_after)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission.release()
+    return wrapper
+
+
+def render_ticket_escpos(from_name: str, question: str, image_raster: bytes = b"") -> bytes:
     """
-    Original rich formatting (uses python-escpos methods).
-    Works for usb/serial/network/bluetooth(classic).
+    Original rich formatting (bold/double-size banner) as ESC/POS bytes.
+    Used for usb/serial/network/bluetooth(classic).
     """
-    try:
-        now = datetime.now()
-        time_str = now.strftime("%I:%M %p")
-        date_str = now.strftime("%B %d, %Y")
+    now = datetime.now()
+    return CLASSIC_TICKET.render(
+        from_name=from_name,
+        time=now.strftime("%I:%M %p"),
+        date=now.strftime("%B %d, %Y"),
+        question=question,
+        image=CLASSIC_IMAGE_HEADER + image_raster if image_raster else b"",
+    )
 
-        printer.set(align="center", font="a", width=2, height=2, bold=True)
-        printer.text("================================\n")
-        printer.text("TICKET\n")
 
-        printer.set(align="center", font="a", width=1, height=1, bold=False)
-        printer.text("--------------------------------\n")
+def _image_raster(image: "Image.Image") -> bytes:
+    from escpos_image import image_to_escpos_raster
+    return image_to_escpos_raster(image)
 
-        printer.set(align="left", font="a", width=1, height=1, bold=True)
-        printer.text(f"From: {from_name}\n")
 
-        printer.set(align="left", font="a", width=1, height=1, bold=False)
-        printer.text(f"Time: {time_str}\n")
-        printer.text(f"Date: {date_str}\n")
+_prepared_images: "OrderedDict[str, concurrent.futures.Future]" = OrderedDict()
+_prepared_lock = threading.Lock()
+_prepare_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="prepare-image")
 
-        printer.text("--------------------------------\n")
 
-        printer.set(align="left", font="a", width=1, height=1, bold=True)
-        printer.text("Question/Comment\n")
+def _image_key(image_base64: str) -> str:
+    return hashlib.sha256(image_base64.encode("utf-8")).hexdigest()
 
-        printer.set(align="left", font="a", width=1, height=1, bold=False)
-        printer.text(f"{question}\n")
 
-        # Print image if provided
-        if image is not None:
-            printer.text("--------------------------------\n")
-            printer.set(align="center")
-            printer.image(image)
+def _decode_image_raster(image_base64: str) -> Optional[bytes]:
+    processed_image = _process_image(image_base64)
+    return None if processed_image is None else _image_raster(processed_image)
 
-        printer.text("--------------------------------\n")
 
-        printer.set(align="center", font="a", width=2, height=2, bold=True)
-        printer.text("================================\n")
+def _prepare_image(image_base64: str):
+    """Decode an image in the background for the print request that will carry it."""
+    key = _image_key(image_base64)
+    with _prepared_lock:
+        if key in _prepared_images:
+            _prepared_images.move_to_end(key)
+            return
+        if sum(not f.done() for f in _prepared_images.values()) >= PREPARE_MAX_PENDING:
+            return  # Decoding is behind; the print will decode this one itself
+        _prepared_images[key] = _prepare_executor.submit(_decode_image_raster, image_base64)
+        while len(_prepared_images) > PREPARE_CACHE_SIZE:
+            _prepared_images.popitem(last=False)[1].cancel()  # No-op once decoded
 
-        printer.text("\n\n")
-        printer.cut()
-        return True
 
-    except Exception as e:
-        logger.error(f"Error printing ticket: {e}")
+def _uploaded_image_raster(image_base64: str) -> Optional[bytes]:
+    """Raster for an uploaded image (None if it can't be decoded), reusing a /prepare decode."""
+    key = _image_key(image_base64)
+    with _prepared_lock:
+        future = _prepared_images.get(key)
+        if future is not None and future.cancel():
+            del _prepared_images[key]  # Still queued behind other decodes: faster to do it here
+            future = None
+    if future is None:
+        return _decode_image_raster(image_base64)
+    with job_trace.render_stage("prepared"):
+        return future.result()
+
+
+def send_payload(payload: bytes, image: bool = False, priority: int = 0) -> dict:
+    """
+    Write a complete ESC/POS payload to the configured printer, directly or
+    through printer_daemon.py when PRINTER_DAEMON_SOCKET is set. Returns the
+    job's estimated_sec (queue wait + print) and estimated_completion time.
+    Raises Overloaded if the job would finish past the admission SLO.
+    """
+    with job_trace.render_stage("heat"):
+        payload = adapt_heat(payload)  # Per-band heat settings, if the printer profile has them
+    job_trace.payload(payload, PRINTER_TYPE, image)
+    if PRINTER_DAEMON_SOCKET:
+        timing = printer_daemon.submit(PRINTER_DAEMON_SOCKET, payload, image=image, priority=priority)
+        job_trace.note("print", timing["service_sec"])  # Queue and chunk timings are in the daemon's trace
+    else:
+        timing = print_locally(payload, image, priority)
+    del timing["service_sec"]  # Already fed to the cost model by print_locally
+    return timing
+
+
+def print_locally(payload: bytes, image: bool = False, priority: int = 0) -> dict:
+    """Send from this process once the scheduler gives the job its turn."""
+    stats = payload_stats(payload)
+    job = PrintJob(cost_model.estimate(stats, PRINTER_TYPE, image), priority)
+    admission.check_drain(scheduler.backlog_sec(), job.estimate)
+    queued = datetime.now()
+    completion = scheduler.quote(job)
+    logger.info(f"Print job queued: ~{job.estimate:.1f}s on the printer, done around {completion:%H:%M:%S}")
+    with scheduler.turn(job):
+        started = time.perf_counter()
+        _send_payload(payload, image)
+        service_sec = time.perf_counter() - started
+    job_trace.note("queue", job.started - job.enqueued)
+    job_trace.note("print", service_sec)
+    cost_model.observe(stats, PRINTER_TYPE, image, service_sec)
+    return {
+        "service_sec": service_sec,
+        "estimated_sec": round((completion - queued).total_seconds(), 1),
+        "estimated_completion": completion.isoformat(timespec="seconds"),
+    }
+
+
+def printer_connected() -> bool:
+    """Whether the configured printer can be reached from this process."""
+    if PRINTER_TYPE == "ble":
+        return bool(BLE_PRINTER_ADDR) and _ble().ble_is_available(BLE_PRINTER_ADDR)
+    if PRINTER_TYPE == "network":
+        import network_printer
+        return network_printer.get_pool(NETWORK_HOST, NETWORK_PORT).check()
+    printer = get_printer()
+    if printer is None:
         return False
+    try:
+        printer.close()
+    except Exception:
+        pass
+    return True
+
+
+def prepare_printer():
+    """Start connecting to the printer ahead of a job (BLE and network), without waiting."""
+    if PRINTER_TYPE == "ble" and BLE_PRINTER_ADDR:
+        _ble().ble_prepare(BLE_PRINTER_ADDR)
+    elif PRINTER_TYPE == "network":
+        import network_printer
+        network_printer.get_pool(NETWORK_HOST, NETWORK_PORT).prepare()
+
+
+def _send_payload(payload: bytes, image: bool):
+    if PRINTER_TYPE == "ble":
+        _ble().ble_send(BLE_PRINTER_ADDR, payload, image=image)
+        return
+
+    with job_trace.transport_op(PRINTER_TYPE, "connect"):
+        printer = get_printer()
+    if printer is None:
+        raise PrinterUnavailable("Printer not available")
+    try:
+        with job_trace.transport_op(PRINTER_TYPE, "write"):
+            job_trace.write_started()
+            printer._raw(payload)
+            job_trace.chunk(len(payload))
+        BYTES_SENT.inc(len(payload), transport=PRINTER_TYPE)
+    finally:
+        try:
+            printer.close()
+        except Exception:
+            pass
 
 
 @app.route("/")
@@ -200,6 +397,8 @@ def index():
 
 
 @app.route("/submit_ticket", methods=["POST"])
+@_instrumented("submit_ticket")
+@_admitted
 def submit_ticket():
     try:
         data = request.json or {}
@@ -224,53 +423,50 @@ def submit_ticket():
             logger.info("=" * 40)
             return jsonify({"success": True, "message": "Ticket logged (TEST MODE - no printer)"}), 200
 
+        if PRINTER_TYPE == "ble" and not BLE_PRINTER_ADDR:
+            return jsonify({"success": False, "error": "BLE_PRINTER_ADDR is not set"}), 500
+
         # Process image if provided
-        processed_image = None
+        image_raster = b""
         if image_base64:
-            processed_image = process_image_base64(image_base64)
-            if processed_image is None:
+            image_raster = _uploaded_image_raster(image_base64) or b""
+            if not image_raster:
                 logger.warning("Failed to process image, printing without it")
+        has_image = bool(image_raster)
 
         # ✅ BLE path (your printer)
         if PRINTER_TYPE == "ble":
-            if not BLE_PRINTER_ADDR:
-                return jsonify({"success": False, "error": "BLE_PRINTER_ADDR is not set"}), 500
+            body = render_ticket(from_name, question)
+            if has_image:
+                body += b"\n" + image_raster
+            timing = send_payload(frame(body), image=has_image, priority=route_priority("submit_ticket"))
 
-            text = build_ticket_text(from_name, question)
-            
-            if processed_image is not None:
-                ble_print_text_with_image(BLE_PRINTER_ADDR, text, processed_image)
-            else:
-                ble_print_text(BLE_PRINTER_ADDR, text)
-
-            has_image = processed_image is not None
             logger.info(f"Ticket printed successfully over BLE from: {from_name} (with image: {has_image})")
-            return jsonify({"success": True, "message": "Ticket printed successfully (BLE)"}), 200
+            return jsonify({"success": True, "message": "Ticket printed successfully (BLE)", **timing}), 200
 
         # Everything else uses escpos printers
-        printer = get_printer()
-        if printer is None:
-            return jsonify({"success": False, "error": "Printer not available"}), 500
-
-        ok = format_ticket_escpos(printer, from_name, question, processed_image)
-        if ok:
-            has_image = processed_image is not None
-            logger.info(f"Ticket printed successfully from: {from_name} (with image: {has_image})")
-            return jsonify({"success": True, "message": "Ticket printed successfully"}), 200
-
-        return jsonify({"success": False, "error": "Failed to print ticket"}), 500
-
+        timing = send_payload(frame(render_ticket_escpos(from_name, question, image_raster)), image=has_image,
+                              priority=route_priority("submit_ticket"))
+        logger.info(f"Ticket printed successfully from: {from_name} (with image: {has_image})")
+        return jsonify({"success": True, "message": "Ticket printed successfully", **timing}), 200
+
+    except Overloaded as e:
+        return _too_many("overload", str(e), e.retry_after)
+    except PrinterUnavailable as e:
+        return jsonify({"success": False, "error": str(e)}), 500
     except Exception as e:
         logger.error(f"Error processing ticket submission: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
 @app.route("/print", methods=["POST"])
+@_instrumented("print")
+@_admitted
 def print_content():
     """Handle generic print requests (text or image)"""
     try:
         data = request.json or {}
-        print_type = data.get("type", "text")  # 'text' or 'image'
+        print_type = data.get("type", "text")  # 'text', 'image', 'raster' (pre-dithered 1-bit), 'qr' or 'barcode'
         content = data.get("content", "")
 
         if not content:
@@ -284,79 +480,100 @@ def print_content():
             logger.info("=" * 40)
             logger.info(f"Type: {print_type}")
             logger.info(f"Date: {format_date_string()}")
-            if print_type == "text":
+            if print_type in ("text", "qr", "barcode"):
                 logger.info(f"Content: {content}")
             else:
                 logger.info(f"Image data length: {len(content)} chars")
             logger.info("=" * 40)
             return jsonify({"success": True, "message": "Printed (TEST MODE)"}), 200
 
-        # BLE printing path
-        if PRINTER_TYPE == "ble":
-            if not BLE_PRINTER_ADDR:
-                return jsonify({"success": False, "error": "BLE_PRINTER_ADDR is not set"}), 500
-
-            if print_type == "text":
-                text_to_print = build_print_content(content)
-                ble_print_text(BLE_PRINTER_ADDR, text_to_print)
-            else:  # image
-                processed_image = process_image_base64(content)
-                if processed_image is None:
-                    return jsonify({"success": False, "error": "Failed to process image"}), 400
-                # Print separator, date, then image
-                header_text = build_print_content("", include_separator=True, include_date=True)
-                ble_print_text_with_image(BLE_PRINTER_ADDR, header_text, processed_image)
-
-            logger.info(f"Printed {print_type} successfully over BLE")
-            return jsonify({"success": True, "message": "Printed successfully (BLE)"}), 200
-
-        # Non-BLE printing (escpos)
-        printer = get_printer()
-        if printer is None:
-            return jsonify({"success": False, "error": "Printer not available"}), 500
+        if PRINTER_TYPE == "ble" and not BLE_PRINTER_ADDR:
+            return jsonify({"success": False, "error": "BLE_PRINTER_ADDR is not set"}), 500
 
+        priority = route_priority("print")
         if print_type == "text":
-            text_to_print = build_print_content(content)
-            printer.set(align="left", font="a", width=1, height=1, bold=False)
-            printer.text(text_to_print)
-            printer.text("\n\n")
-            printer.cut()
+            timing = send_payload(frame(render_print_content(content)), priority=priority)
+        elif print_type in ("qr", "barcode"):
+            # The printer draws the code itself where its profile allows (tens of bytes)
+            try:
+                if print_type == "qr":
+                    code = qr_code(content, data.get("module_size"), data.get("error_correction", "M"))
+                else:
+                    code = barcode(content, data.get("symbology", "CODE128"), data.get("height"), data.get("module_width"))
+            except (ValueError, TypeError) as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+            header = IMAGE_NOTE_HEADER.render(date=format_date_string())
+            timing = send_payload(frame(header + code), image=RASTER in code, priority=priority)
+        elif print_type == "raster":
+            # Already resized and dithered by the client; no PIL work here
+            try:
+                raster = decode_raster(content)
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+            header = IMAGE_NOTE_HEADER.render(date=format_date_string())
+            timing = send_payload(frame(header + raster), image=True, priority=priority)
         else:  # image
-            processed_image = process_image_base64(content)
-            if processed_image is None:
+            image_raster = _uploaded_image_raster(content)
+            if image_raster is None:
                 return jsonify({"success": False, "error": "Failed to process image"}), 400
-            # Print separator and date
-            printer.set(align="left", font="a", width=1, height=1, bold=False)
-            printer.text("--------------------------------\n")
-            printer.text(f"{format_date_string()}\n\n")
-            # Print image
-            printer.set(align="center")
-            printer.image(processed_image)
-            printer.text("\n\n")
-            printer.cut()
+            # Print separator, date, then image
+            header = IMAGE_NOTE_HEADER.render(date=format_date_string())
+            timing = send_payload(frame(header + image_raster), image=True, priority=priority)
+
+        if PRINTER_TYPE == "ble":
+            logger.info(f"Printed {print_type} successfully over BLE")
+            return jsonify({"success": True, "message": "Printed successfully (BLE)", **timing}), 200
 
         logger.info(f"Printed {print_type} successfully")
-        return jsonify({"success": True, "message": "Printed successfully"}), 200
+        return jsonify({"success": True, "message": "Printed successfully", **timing}), 200
 
+    except Overloaded as e:
+        return _too_many("overload", str(e), e.retry_after)
+    except PrinterUnavailable as e:
+        return jsonify({"success": False, "error": str(e)}), 500
     except Exception as e:
         logger.error(f"Error processing print request: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
 
+@app.route("/prepare", methods=["POST"])
+def prepare():
+    """
+    Hint that a print is coming (the form got focus, an image was chosen):
+    connect to the printer, and decode the image if one is sent, in the
+    background, so the print request itself only has to write. Returns at once.
+    """
+    if RATE_LIMIT_ENABLED:
+        retry_after = prepare_limiter.check(_client_key())
+        if retry_after is not None:
+            return _too_many("rate_limit", "Too many prepare requests", retry_after)
+    if TEST_MODE:
+        return jsonify({"success": True, "message": "Nothing to prepare (TEST MODE)"}), 202
+
+    try:
+        if PRINTER_DAEMON_SOCKET:
+            printer_daemon.prepare(PRINTER_DAEMON_SOCKET)
+        else:
+            prepare_printer()
+    except Exception as e:
+        logger.warning(f"Could not start connecting to the printer: {e}")
+
+    image_base64 = (request.get_json(silent=True) or {}).get("image")
+    if isinstance(image_base64, str) and image_base64:
+        _prepare_image(image_base64)
+    return jsonify({"success": True}), 202
+
+
 @app.route("/health", methods=["GET"])
 def health():
     try:
-        if PRINTER_TYPE == "ble":
-            return jsonify({
-                "status": "healthy",
-                "printer_connected": bool(BLE_PRINTER_ADDR) and ble_is_available(BLE_PRINTER_ADDR),
-                "printer_type": "ble"
-            })
-
-        printer = get_printer()
+        if PRINTER_DAEMON_SOCKET:
+            connected = printer_daemon.health(PRINTER_DAEMON_SOCKET)
+        else:
+            connected = printer_connected()
         return jsonify({
             "status": "healthy",
-            "printer_connected": printer is not None,
+            "printer_connected": connected,
             "printer_type": PRINTER_TYPE
         })
 
@@ -364,6 +581,19 @@ def health():
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
 
+@app.route("/capabilities", methods=["GET"])
+def capabilities():
+    """What clients need to pre-render for this printer (see raster_payload)."""
+    return jsonify(dict(client_settings(), raster=True, profile=PROFILE.to_dict(),
+                        barcode_symbologies=list(BARCODE_SYMBOLOGIES)))
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint for the print pipeline."""
+    return Response(render_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
 if __name__ == "__main__":
     DEBUG = os.getenv("DEBUG", "True").lower() == "true"
     app.run(host="0.0.0.0", port=5000, debug=DEBUG)
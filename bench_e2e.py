@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark for the print pipeline.
+
+Drives /print and /submit_ticket through the real Flask routes, rendering
+code and transport code, with the printer replaced by the simulator in
+ble_sim.py (no hardware needed). Reports tickets/s, p50/p99 latency and
+bytes sent.
+
+Examples:
+    python bench_e2e.py --transport ble --jobs 50 --workload mixed
+    python bench_e2e.py --transport ble --mtu 23 --chunk-size 20 --disconnect-rate 0.001
+    python bench_e2e.py --transport ble --printers 2 --adapters 2 --concurrency 4
+    python bench_e2e.py --transport network --jobs 100 --concurrency 4
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from ble_sim import SimulatedPrinter, TcpPrinterSink, simulated_ble
+
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def make_image_base64(width: int = 1024, height: int = 768, seed: int = 0) -> str:
+    """Deterministic photo-like test image (gradient + shapes + noise) as a PNG data URL."""
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(20, 200), y0 + rng.randrange(20, 200)
+        draw.ellipse((x0, y0, x1, y1), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    image = Image.blend(image, noise, 0.2)
+    buf = io.BytesIO()
+    image.save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def make_raster_base64(image_b64: str) -> str:
+    """What the frontend sends for type "raster": the image already resized, dithered and packed."""
+    from escpos_image import IMAGE_CONTRAST, IMAGE_MAX_HEIGHT, IMAGE_MAX_WIDTH, IMAGE_USE_DITHERING, \
+        dither, enhance_contrast, process_image_base64, resize_to_fit
+    from raster_payload import encode_raster
+
+    image = resize_to_fit(process_image_base64(image_b64), IMAGE_MAX_WIDTH, IMAGE_MAX_HEIGHT)
+    image = dither(enhance_contrast(image, IMAGE_CONTRAST), IMAGE_USE_DITHERING)
+    rows = bytes(~b & 0xFF for b in image.tobytes())  # PIL packs 1 = white
+    return encode_raster(image.width, image.height, rows)
+
+
+def build_requests(workload: str, jobs: int, image_b64: str):
+    """List of (route, json body) tuples for the chosen workload."""
+    text = {"type": "text", "content": "Benchmark note: the quick brown fox jumps over the lazy dog.\n" * 3}
+    image = {"type": "image", "content": image_b64}
+    if workload == "qr":
+        return [("/print", {"type": "qr", "content": "https://example.com/tickets/0123456789"})] * jobs
+    if workload == "raster":
+        return [("/print", {"type": "raster", "content": make_raster_base64(image_b64)})] * jobs
+    ticket = {"from_name": "Bench", "question": "Will this ticket print quickly?"}
+    ticket_image = dict(ticket, image=image_b64)
+    mixes = {
+        "text": [("/print", text)],
+        "image": [("/print", image)],
+        "ticket": [("/submit_ticket", ticket)],
+        "ticket-image": [("/submit_ticket", ticket_image)],
+        "mixed": [("/print", text), ("/submit_ticket", ticket), ("/print", text), ("/print", image)],
+    }
+    pattern = mixes[workload]
+    return [pattern[i % len(pattern)] for i in range(jobs)]
+
+
+def run(args) -> dict:
+    import app as app_module
+
+    app_module.TEST_MODE = False
+    app_module.PRINTER_TYPE = args.transport
+    # Measure the pipeline, not the abuse protection
+    app_module.RATE_LIMIT_ENABLED = False
+    app_module.admission.slo_sec = float("inf")
+    app_module.admission.max_depth = max(app_module.admission.max_depth, args.concurrency)
+    client_local = threading.local()
+
+    def client():
+        if not hasattr(client_local, "c"):
+            client_local.c = app_module.app.test_client()
+        return client_local.c
+
+    image_b64 = make_image_base64(args.image_width, args.image_height)
+    requests = build_requests(args.workload, args.jobs, image_b64)
+    latencies = []
+    failures = 0
+
+    def one(route_body):
+        route, body = route_body
+        started = time.perf_counter()
+        resp = client().post(route, json=body)
+        return time.perf_counter() - started, resp.status_code
+
+    def drive():
+        nonlocal failures
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for latency, status in pool.map(one, requests):
+                latencies.append(latency)
+                if status != 200:
+                    failures += 1
+        return time.perf_counter() - started
+
+    if args.transport == "ble":
+        import ble_printer
+
+        from print_scheduler import PrintScheduler
+
+        printers = [
+            SimulatedPrinter(
+                address=f"AA:BB:CC:DD:EE:{i:02X}",
+                mtu=args.mtu,
+                write_latency=args.write_latency,
+                buffer_size=args.buffer_size,
+                print_rate=args.print_rate,
+                disconnect_rate=args.disconnect_rate,
+                scan_latency=args.scan_latency,
+                connect_latency=args.connect_latency,
+                seed=i,
+            )
+            for i in range(args.printers)
+        ]
+        app_module.BLE_PRINTER_ADDR = ",".join(p.address for p in printers)
+        app_module.scheduler = PrintScheduler(capacity=len(printers))
+        if args.chunk_size:
+            ble_printer.BLE_CHUNK_SIZE = args.chunk_size
+            ble_printer.BLE_IMAGE_CHUNK_SIZE = args.chunk_size
+        adapters = [f"hci{i}" for i in range(args.adapters)] if args.adapters > 1 else None
+        with simulated_ble(*printers, adapters=adapters):
+            elapsed = drive()
+        sent = sum(len(p.received) for p in printers)
+        extra = {
+            "writes": sum(p.writes for p in printers),
+            "connections": sum(p.connections for p in printers),
+            "disconnects": sum(p.disconnects for p in printers),
+            "overflow_bytes": sum(p.overflow_bytes for p in printers),
+        }
+        if len(printers) > 1:
+            # Connections are held between jobs, so bytes show how the work was spread
+            extra["bytes_per_printer"] = [len(p.received) for p in printers]
+            extra["connections_per_printer"] = [p.connections for p in printers]
+    else:
+        from metrics import BYTES_SENT
+
+        before = BYTES_SENT.value(transport="network")
+        with TcpPrinterSink(port=args.port, print_rate=args.print_rate or None) as sink:
+            app_module.NETWORK_HOST = f"127.0.0.1:{sink.port}"  # Bound port, so --port 0 works
+            elapsed = drive()
+            # The throttled sink may still be reading; count what the app wrote
+            sent = int(BYTES_SENT.value(transport="network") - before)
+            extra = {"connections": sink.connections}
+
+    return {
+        "transport": args.transport,
+        "workload": args.workload,
+        "jobs": args.jobs,
+        "failures": failures,
+        "elapsed_s": round(elapsed, 3),
+        "tickets_per_s": round(args.jobs / elapsed, 3) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else 0.0,
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "bytes_sent": sent,
+        "bytes_per_ticket": sent // args.jobs if args.jobs else 0,
+        **extra,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=["ble", "network"], default="ble")
+    parser.add_argument("--workload", choices=["text", "image", "raster", "qr", "ticket", "ticket-image", "mixed"], default="mixed")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--image-width", type=int, default=1024)
+    parser.add_argument("--image-height", type=int, default=768)
+    parser.add_argument("--chunk-size", type=int, default=0, help="Override BLE_CHUNK_SIZE / BLE_IMAGE_CHUNK_SIZE")
+    parser.add_argument("--mtu", type=int, default=247)
+    parser.add_argument("--write-latency", type=float, default=0.0075, help="Seconds per GATT write")
+    parser.add_argument("--buffer-size", type=int, default=4096, help="Printer receive buffer (bytes)")
+    parser.add_argument("--print-rate", type=float, default=8000.0, help="Printer drain rate (bytes/s)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Per-write disconnect probability")
+    parser.add_argument("--scan-latency", type=float, default=0.05)
+    parser.add_argument("--connect-latency", type=float, default=0.05)
+    parser.add_argument("--printers", type=int, default=1, help="Simulated BLE printers")
+    parser.add_argument("--adapters", type=int, default=1, help="Simulated HCI adapters the printers are spread over")
+    parser.add_argument("--port", type=int, default=9100, help="TCP sink port for --transport network (0 = any free port)")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("TEST_MODE", "false")
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for key, value in result.items():
+            print(f"{key:>16}: {value}")
+    return 0 if result["failures"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the image rendering paths.
+
+Times each stage of escpos_image's pipeline (decode, composite, resize,
+contrast, dither, pack) separately, plus backend/api.py's
+process_image_for_printing, over a fixed synthetic corpus at 384 and 576
+dot widths. Peak RSS growth is recorded per stage.
+
+A "heat" stage times print_density's per-band heat pass over the packed
+raster; it was added along with adaptive print density.
+
+Results are saved to .benchmarks/render/<time>_<commit>.json; --compare
+diffs against the previous saved run so regressions between commits show up.
+
+Examples:
+    python bench_render.py
+    python bench_render.py --repeat 10 --widths 384 --images jpeg_12mp
+    python bench_render.py --compare           # run, save, diff with previous
+    python bench_render.py --no-save --compare A.json B.json
+"""
+import argparse
+import base64
+import glob
+import importlib.util
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from PIL import Image, ImageDraw
+
+import escpos_image
+from print_density import adapt_heat
+from printer_profile import ESC7_HEAT_LEVELS
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".benchmarks", "render")
+WIDTHS = (384, 576)
+STAGES = ("decode", "composite", "resize", "contrast", "dither", "pack", "heat")
+
+
+# --- Corpus (deterministic, generated in memory) ---
+
+def _encode(image: Image.Image, fmt: str, **kwargs) -> str:
+    buf = io.BytesIO()
+    image.save(buf, format=fmt, **kwargs)
+    return base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def _png_alpha() -> str:
+    """Small sticker-style PNG with a transparent background."""
+    image = Image.new("RGBA", (256, 256), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((16, 16, 240, 240), fill=(220, 40, 90, 255))
+    draw.rectangle((80, 80, 176, 176), fill=(255, 255, 255, 128))
+    return _encode(image, "PNG")
+
+
+def _jpeg_12mp() -> str:
+    """4000x3000 camera-sized photo."""
+    rng = random.Random(12)
+    image = Image.linear_gradient("L").resize((4000, 3000)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(4000), rng.randrange(3000)
+        r = rng.randrange(20, 400)
+        draw.ellipse((x, y, x + r, y + r), fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    image = Image.blend(image, Image.effect_noise((4000, 3000), 30).convert("RGB"), 0.15)
+    return _encode(image, "JPEG", quality=90)
+
+
+def _gif_palette() -> str:
+    """Palette-mode GIF, the mode that takes the 'P' composite branch."""
+    rng = random.Random(3)
+    image = Image.new("RGB", (480, 360), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rng.randrange(480), rng.randrange(360)
+        draw.rectangle((x, y, x + rng.randrange(10, 80), y + rng.randrange(10, 80)),
+                       fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    return _encode(image.convert("P", palette=Image.Palette.ADAPTIVE, colors=64), "GIF")
+
+
+def _tall_screenshot() -> str:
+    """1170x6000 phone screenshot: flat background, many lines of text-like blocks."""
+    rng = random.Random(7)
+    image = Image.new("RGB", (1170, 6000), (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    y = 40
+    while y < 5960:
+        x = 48
+        while x < 1100:
+            w = rng.randrange(30, 160)
+            draw.rectangle((x, y, min(x + w, 1122), y + 28), fill=(30, 30, 30))
+            x += w + 18
+        y += 56
+    return _encode(image, "PNG")
+
+
+CORPUS = {
+    "png_alpha": _png_alpha,
+    "jpeg_12mp": _jpeg_12mp,
+    "gif_palette": _gif_palette,
+    "tall_screenshot": _tall_screenshot,
+}
+
+
+# --- Measurement ---
+
+def _read_status_kb(field: str) -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _reset_peak_rss() -> bool:
+    """Reset VmHWM (Linux >= 4.0). Returns False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _measure(fn, arg, repeat: int):
+    """Run fn(arg) `repeat` times; return (result, times, peak RSS growth in KiB)."""
+    can_reset = _reset_peak_rss()
+    baseline = _read_status_kb("VmRSS") if can_reset else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(arg)
+        times.append(time.perf_counter() - started)
+    peak = _read_status_kb("VmHWM") if can_reset else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result, times, max(0, peak - baseline)
+
+
+def _load_backend_api():
+    """Import backend/api.py as a module (it is a script, not a package)."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend", "api.py")
+    spec = importlib.util.spec_from_file_location("backend_api", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(images, widths, repeat: int, include_backend: bool = True):
+    backend = None
+    if include_backend:
+        try:
+            backend = _load_backend_api()
+        except Exception as e:  # escpos/flask missing: skip that path only
+            print(f"Skipping backend/api.py: {e}", file=sys.stderr)
+
+    results = []
+    for name in images:
+        data = CORPUS[name]()
+        decoded, t, rss = _measure(escpos_image.decode_image, data, repeat)
+        base = {"image": name, "size": list(decoded.size), "mode": decoded.mode}
+        results.append(dict(base, width=None, stage="decode", times=t, peak_rss_kib=rss))
+        rgb, t, rss = _measure(escpos_image.flatten_to_rgb, decoded, repeat)
+        results.append(dict(base, width=None, stage="composite", times=t, peak_rss_kib=rss))
+
+        for width in widths:
+            resized, t, rss = _measure(lambda im: escpos_image.resize_to_fit(im, width, escpos_image.IMAGE_MAX_HEIGHT), rgb, repeat)
+            results.append(dict(base, width=width, stage="resize", times=t, peak_rss_kib=rss))
+            gray, t, rss = _measure(lambda im: escpos_image.enhance_contrast(im, escpos_image.IMAGE_CONTRAST), resized, repeat)
+            results.append(dict(base, width=width, stage="contrast", times=t, peak_rss_kib=rss))
+            mono, t, rss = _measure(lambda im: escpos_image.dither(im, True), gray, repeat)
+            results.append(dict(base, width=width, stage="dither", times=t, peak_rss_kib=rss))
+            raster, t, rss = _measure(escpos_image.pack_raster, mono, repeat)
+            results.append(dict(base, width=width, stage="pack", times=t, peak_rss_kib=rss, raster_bytes=len(raster)))
+            _, t, rss = _measure(lambda r: adapt_heat(r, ESC7_HEAT_LEVELS), raster, repeat)
+            results.append(dict(base, width=width, stage="heat", times=t, peak_rss_kib=rss))
+            if backend is not None:
+                _, t, rss = _measure(lambda d: backend.process_image_for_printing(d, max_width=width), data, repeat)
+                results.append(dict(base, width=width, stage="backend_process", times=t, peak_rss_kib=rss))
+
+    for row in results:
+        times = row.pop("times")
+        row["min_ms"] = round(min(times) * 1000, 3)
+        row["median_ms"] = round(statistics.median(times) * 1000, 3)
+    return results
+
+
+# --- Persistence / comparison ---
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def save(results, repeat: int) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = _git_commit()
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(RESULTS_DIR, f"{stamp}_{commit}.json")
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "created": stamp, "repeat": repeat, "python": sys.version.split()[0],
+                   "pillow": Image.__version__, "results": results}, f, indent=1)
+    return path
+
+
+def _key(row):
+    return (row["image"], row["width"], row["stage"])
+
+
+def compare(old_path: str, new_path: str, threshold: float = 0.10):
+    with open(old_path) as f:
+        old = {_key(r): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"\nComparing {os.path.basename(old_path)} -> {os.path.basename(new_path)} (median)")
+    regressions = 0
+    for row in new:
+        prev = old.get(_key(row))
+        if not prev or not prev["median_ms"]:
+            continue
+        change = (row["median_ms"] - prev["median_ms"]) / prev["median_ms"]
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        width = row["width"] or "-"
+        print(f"  {row['image']:<16} {width!s:>4} {row['stage']:<16} {prev['median_ms']:>10.2f} -> {row['median_ms']:>10.2f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'image':<16} {'width':>5} {'stage':<16} {'min ms':>10} {'median ms':>10} {'peak RSS KiB':>13}")
+    for row in results:
+        width = row["width"] or "-"
+        print(f"{row['image']:<16} {width!s:>5} {row['stage']:<16} {row['min_ms']:>10.2f} {row['median_ms']:>10.2f} {row['peak_rss_kib']:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--widths", type=int, nargs="+", default=list(WIDTHS))
+    parser.add_argument("--images", nargs="+", choices=sorted(CORPUS), default=list(CORPUS))
+    parser.add_argument("--no-backend", action="store_true", help="Skip backend/api.py process_image_for_printing")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", nargs="*", metavar="RESULT_JSON",
+                        help="Compare with the previous saved run, or between two given result files")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative slowdown flagged as regression")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) == 2:
+        return 1 if compare(args.compare[0], args.compare[1], args.threshold) else 0
+
+    previous = sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")))
+    results = run(args.images, args.widths, args.repeat, include_backend=not args.no_backend)
+    print_table(results)
+
+    if args.no_save:
+        return 0
+    path = save(results, args.repeat)
+    print(f"\nSaved {path}")
+    if args.compare is not None and previous:
+        return 1 if compare(previous[-1], path, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
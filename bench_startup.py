@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the print server.
+
+Imports app.py in a fresh interpreter for each PRINTER_TYPE (as a service
+restart or gunicorn worker boot would) and reports the median import time
+and which heavy backends ended up loaded. Only the configured driver should
+appear; PIL should not load until an image is printed.
+
+Examples:
+    python bench_startup.py
+    python bench_startup.py --types ble usb --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("PIL.Image", "bleak", "escpos.printer", "usb.core", "serial")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(printer_type: str, runs: int):
+    env = dict(os.environ, PRINTER_TYPE=printer_type, TEST_MODE="false")
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples, loaded = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, env=env, cwd=here, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        loaded = result["loaded"]
+    return statistics.median(samples), min(samples), loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", nargs="+", default=["usb", "serial", "network", "bluetooth", "ble"])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    print(f"{'PRINTER_TYPE':<12} {'median ms':>10} {'min ms':>8}  heavy modules loaded by 'import app'")
+    for printer_type in args.types:
+        median, best, loaded = measure(printer_type, args.runs)
+        print(f"{printer_type:<12} {median * 1000:>10.1f} {best * 1000:>8.1f}  {', '.join(loaded) or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,35 @@
+"""
+BLE (GATT) printing.
+
+BLE_PRINTER_ADDR may list several printers ("AA:..:01,AA:..:02@hci1"). Each
+is bound to one HCI adapter: the one given after "@", otherwise the adapters
+in BLE_ADAPTERS (default: every adapter the system has) in turn. Jobs run on
+one shared event loop; each goes to the least busy printer, and printers on
+different adapters write concurrently instead of sharing one radio's airtime.
+Scanning and connecting take turns per adapter, since BlueZ does not run two
+discoveries on one adapter at once.
+
+Scan plus connect costs seconds per job, so a connection is held for
+BLE_HOLD_SEC after a job in case another follows, and prepare() opens one
+ahead of a job (the web app calls it while the user is still typing). A
+held connection that went stale is replaced before any byte is written.
+"""
+from __future__ import annotations
+
 import asyncio
-import base64
-import io
+import contextlib
+import logging
 import os
-from typing import Optional
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
 from bleak import BleakClient, BleakScanner
-from PIL import Image
+
+import job_trace
+from metrics import BYTES_SENT, DISCONNECTS, RETRIES
+from printer_pool import LoopThread, PrinterPool
 
 
 BLE_WRITE_UUID = os.getenv("BLE_WRITE_UUID", "").strip() or "00002af1-0000-1000-8000-00805f9b34fb"
@@ -15,12 +39,18 @@ BLE_IMAGE_CHUNK_SIZE = int(os.getenv("BLE_IMAGE_CHUNK_SIZE", "200"))  # Larger c
 BLE_IMAGE_WRITE_GAP_SEC = float(os.getenv("BLE_IMAGE_WRITE_GAP_SEC", "0.01"))  # Faster default
 BLE_USE_RESPONSE = os.getenv("BLE_USE_RESPONSE", "true").lower() in ("true", "1", "yes")  # Use response-based flow control
 BLE_SCAN_TIMEOUT = float(os.getenv("BLE_SCAN_TIMEOUT", "15"))  # Longer timeout for flaky connections
+BLE_ADAPTERS = os.getenv("BLE_ADAPTERS", "").strip()  # e.g. "hci0,hci1"; empty = all adapters found
+BLE_HOLD_SEC = float(os.getenv("BLE_HOLD_SEC", "30"))  # Keep an idle connection for the next job; 0 = disconnect
+
+logger = logging.getLogger(__name__)
+
+
+class PrinterNotFound(RuntimeError):
+    """The printer did not show up in a scan; nothing was sent to it."""
+
 
-# Image processing settings
-IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "384"))  # 384 for 58mm, 576 for 80mm printers
-IMAGE_MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "800"))  # Limit height to control print time
-IMAGE_USE_DITHERING = os.getenv("IMAGE_USE_DITHERING", "true").lower() in ("true", "1", "yes")
-IMAGE_CONTRAST = float(os.getenv("IMAGE_CONTRAST", "1.5"))  # Contrast boost (1.0 = no change)
+class PartialWrite(RuntimeError):
+    """The link failed after part of the payload was sent; resending would print it twice."""
 
 
 def _chunk(data: bytes, n: int):
@@ -28,120 +58,12 @@ def _chunk(data: bytes, n: int):
         yield data[i : i + n]
 
 
-def _escpos_frame(text: str) -> bytes:
-    """
-    Minimal ESC/POS:
-      ESC @      initialize
-      text
-      \n\n\n     feed
-      GS V 0     cut (some printers ignore)
-    """
-    return (
-        b"\x1b@" +
-        text.encode("utf-8", errors="replace") +
-        b"\n\n\n" +
-        b"\x1dV\x00"
-    )
+def _adapter_args(adapter: Optional[str]) -> dict:
+    # Only BlueZ can pick an adapter; None leaves the choice to bleak
+    return {"bluez": {"adapter": adapter}} if adapter else {}
 
 
-def _image_to_escpos_raster(image: Image.Image, max_width: int = None, max_height: int = None, use_dithering: bool = None, contrast: float = None) -> bytes:
-    """
-    Convert PIL Image to ESC/POS raster bitmap format (GS v 0 command).
-    
-    Args:
-        image: PIL Image to convert
-        max_width: Maximum width in pixels (default 384 for 58mm thermal printers)
-        max_height: Maximum height in pixels (limits print time for tall images)
-        use_dithering: Use Floyd-Steinberg dithering for better detail (default True)
-        contrast: Contrast enhancement factor (1.0 = no change, 1.5 = 50% boost)
-    """
-    # Use env var defaults
-    if max_width is None:
-        max_width = IMAGE_MAX_WIDTH
-    if max_height is None:
-        max_height = IMAGE_MAX_HEIGHT
-    if use_dithering is None:
-        use_dithering = IMAGE_USE_DITHERING
-    if contrast is None:
-        contrast = IMAGE_CONTRAST
-    
-    # Resize if needed (maintain aspect ratio)
-    if image.width > max_width or image.height > max_height:
-        ratio = min(max_width / image.width, max_height / image.height)
-        new_width = int(image.width * ratio)
-        new_height = int(image.height * ratio)
-        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    
-    # Convert to grayscale first for better processing
-    image = image.convert('L')
-    
-    # Enhance contrast for thermal printer (they need high contrast)
-    if contrast != 1.0:
-        from PIL import ImageEnhance
-        enhancer = ImageEnhance.Contrast(image)
-        image = enhancer.enhance(contrast)
-    
-    # Convert to 1-bit with dithering for better detail preservation
-    if use_dithering:
-        # Floyd-Steinberg dithering - much better for intricate images
-        image = image.convert('1', dither=Image.Dither.FLOYDSTEINBERG)
-    else:
-        # Simple threshold - faster but loses detail
-        image = image.convert('1', dither=Image.Dither.NONE)
-    
-    width = image.width
-    height = image.height
-    
-    # Calculate bytes per line (must be multiple of 8 bits)
-    bytes_per_line = (width + 7) // 8
-    
-    # Fast raster conversion using PIL's tobytes()
-    # Pack pixels into bytes (8 pixels per byte, MSB first)
-    # PIL's '1' mode tobytes gives us packed bits, but we need to invert
-    raw_bytes = image.tobytes()
-    
-    # Invert bits (PIL: 0=black, 1=white; ESC/POS: 1=print/black, 0=white)
-    raster_data = bytes(~b & 0xFF for b in raw_bytes)
-    
-    # Build GS v 0 command
-    # GS v 0 m xL xH yL yH [data]
-    xL = bytes_per_line & 0xFF
-    xH = (bytes_per_line >> 8) & 0xFF
-    yL = height & 0xFF
-    yH = (height >> 8) & 0xFF
-    
-    command = bytes([0x1D, 0x76, 0x30, 0x00, xL, xH, yL, yH])
-    
-    return command + raster_data
-
-
-def process_image_base64(image_base64: str, max_width: int = 384) -> Optional[Image.Image]:
-    """Process base64 image string to PIL Image."""
-    try:
-        # Remove data URL prefix if present
-        if ',' in image_base64:
-            image_base64 = image_base64.split(',')[1]
-        
-        image_data = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Handle transparency
-        if image.mode in ('RGBA', 'P'):
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'RGBA':
-                background.paste(image, mask=image.split()[3])
-            else:
-                background.paste(image)
-            image = background
-        elif image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        return image
-    except Exception:
-        return None
-
-
-async def _find_device_by_address(addr: str, timeout: float = None):
+async def _find_device_by_address(addr: str, timeout: float = None, adapter: Optional[str] = None):
     if timeout is None:
         timeout = BLE_SCAN_TIMEOUT
     addr = addr.upper()
@@ -149,106 +71,248 @@ async def _find_device_by_address(addr: str, timeout: float = None):
     def matcher(d, _ad):
         return (d.address or "").upper() == addr
 
-    return await BleakScanner.find_device_by_filter(matcher, timeout=timeout)
+    return await BleakScanner.find_device_by_filter(matcher, timeout=timeout, **_adapter_args(adapter))
 
 
-async def _ble_write(addr: str, payload: bytes, chunk_size: int = None, write_gap: float = None, use_response: bool = None, retries: int = 2):
-    if chunk_size is None:
-        chunk_size = BLE_CHUNK_SIZE
-    if write_gap is None:
-        write_gap = BLE_WRITE_GAP_SEC
-    if use_response is None:
-        use_response = BLE_USE_RESPONSE
-    
+async def _ble_connect(addr: str, adapter: Optional[str] = None, connect_lock: Optional[asyncio.Lock] = None,
+                       retries: int = 2) -> BleakClient:
+    """Scan for the printer and connect. Nothing has been sent yet, so failures are retried."""
     last_error = None
     for attempt in range(retries + 1):
-        started_writing = False
-        write_complete = False
         try:
-            device = await _find_device_by_address(addr)
-            if device is None:
-                raise RuntimeError(f"Printer not found in BLE scan: {addr}. Is it on (and not connected to another device)?")
-
-            async with BleakClient(device, timeout=20.0) as client:
-                if not client.is_connected:
-                    raise RuntimeError("BLE connect failed (client not connected).")
-
-                # Use response=True for flow control (faster for images)
-                # or response=False with delays for compatibility
-                chunks = list(_chunk(payload, chunk_size))
-                for i, part in enumerate(chunks):
-                    await client.write_gatt_char(BLE_WRITE_UUID, part, response=use_response)
-                    started_writing = True  # Mark that we've sent data
-                    if not use_response and write_gap:
-                        await asyncio.sleep(write_gap)
-                
-                write_complete = True  # All data sent successfully
-                return  # Success
+            async with connect_lock or contextlib.nullcontext():
+                with job_trace.transport_op("ble", "scan"):
+                    device = await _find_device_by_address(addr, adapter=adapter)
+                if device is None:
+                    raise PrinterNotFound(f"Printer not found in BLE scan: {addr}. Is it on (and not connected to another device)?")
+
+                connect_started = time.perf_counter()
+                client = BleakClient(device, timeout=20.0, **_adapter_args(adapter))
+                await client.connect()
+                job_trace.note_transport("ble", "connect", time.perf_counter() - connect_started)
+            if not client.is_connected:
+                raise RuntimeError("BLE connect failed (client not connected).")
+            return client
         except Exception as e:
-            # If all data was sent, treat disconnect errors as success
-            # (the printer got all the data, disconnect is just cleanup)
-            if write_complete:
-                return  # Data was sent, ignore disconnect errors
-            
             last_error = e
-            # Don't retry if we already started writing - it would cause duplicate prints
-            if started_writing:
-                raise
             if attempt < retries:
+                RETRIES.inc(transport="ble")
                 await asyncio.sleep(2)  # Wait before retry
-            continue
-    
     raise last_error
 
 
-def ble_print_text(addr: str, text: str):
-    payload = _escpos_frame(text)
-    asyncio.run(_ble_write(addr, payload))
-
-
-def ble_print_image(addr: str, image: Image.Image):
-    """Print a PIL Image via BLE."""
-    # Initialize printer
-    init_cmd = b"\x1b@"
-    # Convert image to ESC/POS raster format
-    image_data = _image_to_escpos_raster(image)
-    # Feed and cut
-    footer = b"\n\n\n\x1dV\x00"
-    
-    payload = init_cmd + image_data + footer
-    
-    # Use larger chunks and slower timing for image data
-    asyncio.run(_ble_write(addr, payload, BLE_IMAGE_CHUNK_SIZE, BLE_IMAGE_WRITE_GAP_SEC))
-
-
-def ble_print_text_with_image(addr: str, text: str, image: Optional[Image.Image] = None):
-    """Print text with optional image via BLE."""
-    # Initialize printer
-    init_cmd = b"\x1b@"
-    # Text content
-    text_data = text.encode("utf-8", errors="replace")
-    
-    payload = init_cmd + text_data
-    
-    # Add image if provided
-    if image is not None:
-        payload += b"\n"
-        payload += _image_to_escpos_raster(image)
-    
-    # Feed and cut
-    payload += b"\n\n\n\x1dV\x00"
-    
-    # Use image timing if we have an image, otherwise text timing
-    if image is not None:
-        asyncio.run(_ble_write(addr, payload, BLE_IMAGE_CHUNK_SIZE, BLE_IMAGE_WRITE_GAP_SEC))
-    else:
-        asyncio.run(_ble_write(addr, payload))
+async def _write_payload(client: BleakClient, payload: bytes, chunk_size: int = None, write_gap: float = None,
+                         use_response: bool = None):
+    """Write the payload in chunks. Raises PartialWrite if the link fails after the first chunk."""
+    if chunk_size is None:
+        chunk_size = BLE_CHUNK_SIZE
+    if write_gap is None:
+        write_gap = BLE_WRITE_GAP_SEC
+    if use_response is None:
+        use_response = BLE_USE_RESPONSE
+
+    started_writing = False
+    try:
+        # Use response=True for flow control (faster for images)
+        # or response=False with delays for compatibility
+        with job_trace.transport_op("ble", "write"):
+            job_trace.write_started()
+            for part in _chunk(payload, chunk_size):
+                await client.write_gatt_char(BLE_WRITE_UUID, part, response=use_response)
+                started_writing = True  # Mark that we've sent data
+                job_trace.chunk(len(part))
+                BYTES_SENT.inc(len(part), transport="ble")
+                if not use_response and write_gap:
+                    await asyncio.sleep(write_gap)
+    except Exception as e:
+        # Don't retry if we already started writing - it would cause duplicate prints
+        if started_writing:
+            DISCONNECTS.inc(transport="ble")
+            raise PartialWrite(f"BLE link lost mid-job: {e}") from e
+        raise
+
 
+async def _disconnect(client: BleakClient):
+    # The printer got everything that was sent; a failed disconnect is just cleanup
+    with contextlib.suppress(Exception):
+        await client.disconnect()
 
-def ble_is_available(addr: str) -> bool:
-    async def _check():
-        device = await _find_device_by_address(addr, timeout=3.0)
-        return device is not None
 
-    return asyncio.run(_check())
+def list_adapters() -> List[Optional[str]]:
+    """HCI adapters to spread printers over: BLE_ADAPTERS, else all found; [None] = bleak's default."""
+    if BLE_ADAPTERS:
+        return [a.strip() for a in BLE_ADAPTERS.split(",") if a.strip()]
+    try:
+        names = [n for n in os.listdir("/sys/class/bluetooth") if re.fullmatch(r"hci\d+", n)]
+    except OSError:
+        names = []
+    return sorted(names, key=lambda n: int(n[3:])) or [None]
+
+
+def parse_printers(spec: str, adapters: List[Optional[str]]) -> List[Tuple[str, Optional[str]]]:
+    """'ADDR[@hciN],...' -> [(address, adapter)]; unpinned printers take the adapters in turn."""
+    printers = []
+    unpinned = 0
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        addr, _, adapter = item.partition("@")
+        if not adapter:
+            adapter = adapters[unpinned % len(adapters)]
+            unpinned += 1
+        printers.append((addr.strip().upper(), adapter or None))
+    return printers
+
+
+_loop = LoopThread("ble-printer")
+
+
+class BlePrinterPool(PrinterPool):
+    """BLE printers bound to adapters, sharing one event loop."""
+
+    unreachable = (PrinterNotFound,)
+
+    def __init__(self, printers: List[Tuple[str, Optional[str]]]):
+        if not printers:
+            raise ValueError("No BLE printer configured (BLE_PRINTER_ADDR)")
+        super().__init__(len(printers))
+        self.printers = printers
+        # Created on the loop, on first use
+        self._printer_locks: Optional[List[asyncio.Lock]] = None
+        self._adapter_locks: Dict[Optional[str], asyncio.Lock] = {}
+        # Connections held between jobs, and their idle-close timers (loop only)
+        self._held: Dict[int, BleakClient] = {}
+        self._hold_timers: Dict[int, asyncio.TimerHandle] = {}
+        for addr, adapter in printers:
+            logger.info(f"BLE printer {addr} on adapter {adapter or 'default'}")
+
+    def _locks(self):
+        if self._printer_locks is None:
+            self._printer_locks = [asyncio.Lock() for _ in self.printers]
+            self._adapter_locks = {adapter: asyncio.Lock() for _, adapter in self.printers}
+        return self._printer_locks
+
+    def _take(self, index: int) -> Optional[BleakClient]:
+        """The held connection to printer `index`, if it is still up."""
+        timer = self._hold_timers.pop(index, None)
+        if timer is not None:
+            timer.cancel()
+        client = self._held.pop(index, None)
+        if client is not None and not client.is_connected:
+            logger.info(f"Held BLE connection to {self.printers[index][0]} was dropped")
+            return None
+        return client
+
+    async def _hold(self, index: int, client: BleakClient):
+        """Keep the connection for BLE_HOLD_SEC in case another job follows."""
+        if BLE_HOLD_SEC <= 0 or not client.is_connected:
+            await _disconnect(client)
+            return
+        self._held[index] = client
+        self._hold_timers[index] = asyncio.get_running_loop().call_later(
+            BLE_HOLD_SEC, lambda: asyncio.ensure_future(self._close_idle(index, client)))
+
+    async def _close_idle(self, index: int, client: BleakClient):
+        if self._held.get(index) is client:  # Not taken by a job in the meantime
+            del self._held[index]
+            self._hold_timers.pop(index, None)
+            logger.info(f"Closing idle BLE connection to {self.printers[index][0]}")
+            await _disconnect(client)
+
+    async def _send(self, index: int, payload: bytes, image: bool):
+        addr, adapter = self.printers[index]
+        chunking = (BLE_IMAGE_CHUNK_SIZE, BLE_IMAGE_WRITE_GAP_SEC) if image else (None, None)
+        async with self._locks()[index]:
+            client = self._take(index)
+            for attempt in (1, 2):
+                if client is None:
+                    client = await _ble_connect(addr, adapter, self._adapter_locks[adapter])
+                try:
+                    await _write_payload(client, payload, *chunking)
+                    break
+                except PartialWrite:
+                    await _disconnect(client)
+                    raise
+                except Exception as e:
+                    # Nothing went out (typically a held connection gone stale): reconnect once
+                    await _disconnect(client)
+                    if attempt == 2:
+                        raise
+                    RETRIES.inc(transport="ble")
+                    logger.info(f"BLE write to {addr} failed before sending anything ({e}); reconnecting")
+                    client = None
+            await self._hold(index, client)
+
+    async def _warm(self, index: int):
+        addr, adapter = self.printers[index]
+        lock = self._locks()[index]
+        if lock.locked():
+            return  # A job (or another warm-up) has it, and holds the connection afterwards
+        async with lock:
+            client = self._take(index)
+            try:
+                if client is None:
+                    client = await _ble_connect(addr, adapter, self._adapter_locks[adapter], retries=0)
+                    logger.info(f"Connected to BLE printer {addr} ahead of a job")
+            except Exception as e:
+                logger.info(f"Could not connect to BLE printer {addr} ahead of a job: {e}")
+                return
+            await self._hold(index, client)  # Restarts the idle window of an already held one
+
+    def prepare(self):
+        """Start connecting to every idle printer for a job that is about to come; does not wait."""
+        async def warm_all():
+            await asyncio.gather(*(self._warm(i) for i in range(len(self.printers))))
+
+        _loop.spawn(warm_all())
+
+    def _connected(self, index: int) -> bool:
+        return index in self._held
+
+    def send(self, payload: bytes, image: bool = False):
+        """Print on the least busy printer; one that can't be found hands the job to the next."""
+        self._least_busy(lambda index: _loop.run(self._send(index, payload, image)))
+
+    def is_available(self) -> bool:
+        async def check():
+            async def one(index, addr, adapter):
+                if index in self._held:
+                    return True  # Connected printers stop advertising, so a scan would miss it
+                async with self._adapter_locks[adapter]:
+                    return await _find_device_by_address(addr, timeout=3.0, adapter=adapter) is not None
+            self._locks()
+            found = await asyncio.gather(*(one(i, a, ad) for i, (a, ad) in enumerate(self.printers)),
+                                         return_exceptions=True)
+            return any(f is True for f in found)
+
+        return _loop.run(check())
+
+
+_POOLS: Dict[str, BlePrinterPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(spec: str) -> BlePrinterPool:
+    """The shared pool for a BLE_PRINTER_ADDR value."""
+    with _pools_lock:
+        pool = _POOLS.get(spec)
+        if pool is None:
+            pool = _POOLS[spec] = BlePrinterPool(parse_printers(spec, list_adapters()))
+    return pool
+
+
+def ble_send(addr: str, payload: bytes, image: bool = False):
+    """
+    Send a complete, pre-rendered ESC/POS payload. Image payloads use the larger
+    image chunking. `addr` may list several printers (see the module docstring).
+    """
+    get_pool(addr).send(payload, image)
+
+
+def ble_prepare(addr: str):
+    """Start connecting to the printer(s) in `addr` in the background, ahead of a job."""
+    get_pool(addr).prepare()
+
+
+def ble_is_available(addr: str) -> bool:
+    """Whether any of the printers in `addr` shows up in a scan."""
+    return get_pool(addr).is_available()
 
@@ -0,0 +1,311 @@
+"""
+Synthetic printer simulator for benchmarking without hardware.
+
+Provides stand-ins for the two transports the app talks to:
+  - SimulatedPrinter + simulated_ble(): fake bleak scanner/client/characteristic
+    with configurable MTU, per-write latency, receive buffer size, print speed
+    and random disconnects. Patched into ble_printer so the real connect,
+    chunking and retry code runs against it. simulated_ble(adapters=...) adds
+    fake HCI adapters; links on one adapter share its airtime.
+  - TcpPrinterSink: a raw TCP sink (port 9100 by default) for PRINTER_TYPE=network.
+
+See bench_e2e.py for the benchmark harness that drives the Flask routes.
+"""
+import asyncio
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Sequence
+
+from bleak.exc import BleakError
+
+
+class SimulatedPrinter:
+    """
+    State of one fake BLE printer.
+
+    Args:
+        address: BLE address the scanner will report
+        mtu: ATT MTU; writes larger than mtu - 3 bytes are rejected like BlueZ does
+        write_latency: seconds per GATT write (connection interval / radio time)
+        buffer_size: printer receive buffer in bytes
+        print_rate: bytes/s the print head drains from the buffer
+        disconnect_rate: probability that any single write drops the link
+        scan_latency / connect_latency: seconds spent in discovery / connection
+        seed: RNG seed so disconnect patterns are reproducible
+    """
+
+    def __init__(
+        self,
+        address: str = "AA:BB:CC:DD:EE:FF",
+        mtu: int = 247,
+        write_latency: float = 0.0075,
+        buffer_size: int = 4096,
+        print_rate: float = 8000.0,
+        disconnect_rate: float = 0.0,
+        scan_latency: float = 0.05,
+        connect_latency: float = 0.05,
+        seed: int = 0,
+    ):
+        self.address = address.upper()
+        self.mtu = mtu
+        self.write_latency = write_latency
+        self.buffer_size = buffer_size
+        self.print_rate = print_rate
+        self.disconnect_rate = disconnect_rate
+        self.scan_latency = scan_latency
+        self.connect_latency = connect_latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._buffered = 0.0
+        self._drained_at = time.monotonic()
+        self.received = bytearray()
+        self.writes = 0
+        self.overflow_bytes = 0
+        self.disconnects = 0
+        self.connections = 0
+
+    @property
+    def max_write(self) -> int:
+        return self.mtu - 3
+
+    def _drain(self):
+        now = time.monotonic()
+        self._buffered = max(0.0, self._buffered - (now - self._drained_at) * self.print_rate)
+        self._drained_at = now
+
+    def buffer_wait(self, n: int) -> float:
+        """Seconds until n more bytes fit in the receive buffer."""
+        with self._lock:
+            self._drain()
+            excess = self._buffered + n - self.buffer_size
+            return excess / self.print_rate if excess > 0 else 0.0
+
+    def accept(self, data: bytes):
+        with self._lock:
+            self._drain()
+            free = self.buffer_size - self._buffered
+            if len(data) > free:
+                # Write-without-response into a full buffer: the printer drops it
+                self.overflow_bytes += len(data) - max(0, int(free))
+            self._buffered = min(self.buffer_size, self._buffered + len(data))
+            self.received.extend(data)
+            self.writes += 1
+
+    def should_disconnect(self) -> bool:
+        return self.disconnect_rate > 0 and self._rng.random() < self.disconnect_rate
+
+    def reset_counters(self):
+        with self._lock:
+            self.received = bytearray()
+            self.writes = self.overflow_bytes = self.disconnects = self.connections = 0
+
+
+class SimulatedAdapter:
+    """One fake HCI adapter: GATT writes of all its links take turns on the radio."""
+
+    def __init__(self, name: Optional[str]):
+        self.name = name
+        self._lock = threading.Lock()
+        self._busy_until = 0.0
+        self.writes = 0
+
+    async def transmit(self, seconds: float):
+        with self._lock:
+            now = time.monotonic()
+            done = self._busy_until = max(now, self._busy_until) + seconds
+            self.writes += 1
+        await asyncio.sleep(done - now)
+
+
+_adapters: Dict[Optional[str], SimulatedAdapter] = {None: SimulatedAdapter(None)}
+
+
+def _adapter(kwargs: dict) -> SimulatedAdapter:
+    name = (kwargs.get("bluez") or {}).get("adapter")
+    if name not in _adapters:
+        raise BleakError(f"adapter '{name}' not found")
+    return _adapters[name]
+
+
+class _SimulatedDevice:
+    def __init__(self, printer: SimulatedPrinter):
+        self.address = printer.address
+        self.name = "SimulatedPrinter"
+        self.printer = printer
+
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid: str, max_write: int):
+        self.uuid = uuid
+        self.properties = ["write", "write-without-response"]
+        self.max_write_without_response_size = max_write
+
+
+class _SimulatedService:
+    def __init__(self, characteristics):
+        self.uuid = "000018f0-0000-1000-8000-00805f9b34fb"
+        self.characteristics = characteristics
+
+
+class SimulatedBleakClient:
+    """Drop-in for bleak.BleakClient backed by a SimulatedPrinter."""
+
+    def __init__(self, device, timeout: float = 20.0, **kwargs):
+        printer = getattr(device, "printer", None)
+        if printer is None:
+            raise BleakError(f"Device {device} is not a simulated printer")
+        self.printer = printer
+        self.adapter = _adapter(kwargs)
+        self.address = printer.address
+        self.is_connected = False
+        self.mtu_size = printer.mtu
+        self.services = [_SimulatedService([SimulatedCharacteristic("00002af1-0000-1000-8000-00805f9b34fb", printer.max_write)])]
+
+    async def connect(self, **kwargs):
+        await asyncio.sleep(self.printer.connect_latency)
+        self.is_connected = True
+        self.printer.connections += 1
+        return True
+
+    async def disconnect(self):
+        self.is_connected = False
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.disconnect()
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = False):
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        if len(data) > self.printer.max_write:
+            raise BleakError(f"Write of {len(data)} bytes exceeds MTU payload {self.printer.max_write}")
+        if self.printer.should_disconnect():
+            self.is_connected = False
+            self.printer.disconnects += 1
+            raise BleakError("Simulated disconnect")
+        if response:
+            # Write-with-response: the printer only acks once it has room
+            wait = self.printer.buffer_wait(len(data))
+            if wait:
+                await asyncio.sleep(wait)
+        await self.adapter.transmit(self.printer.write_latency)
+        self.printer.accept(bytes(data))
+
+
+class SimulatedBleakScanner:
+    """Drop-in for the bleak.BleakScanner class methods ble_printer uses."""
+
+    printers = []
+
+    @classmethod
+    async def find_device_by_filter(cls, filterfunc, timeout: float = 10.0, **kwargs):
+        _adapter(kwargs)
+        for printer in cls.printers:
+            await asyncio.sleep(printer.scan_latency)
+            device = _SimulatedDevice(printer)
+            if filterfunc(device, None):
+                return device
+        return None
+
+    @classmethod
+    async def find_device_by_address(cls, address: str, timeout: float = 10.0, **kwargs):
+        return await cls.find_device_by_filter(lambda d, _ad: d.address == address.upper(), timeout)
+
+
+@contextmanager
+def simulated_ble(*printers: SimulatedPrinter, adapters: Optional[Sequence[str]] = None):
+    """
+    Patch ble_printer to talk to the given simulated printers, through fake
+    adapters named in `adapters` (e.g. ["hci0", "hci1"]) or bleak's default one.
+    """
+    global _adapters
+    import ble_printer
+
+    saved = (ble_printer.BleakClient, ble_printer.BleakScanner, ble_printer.list_adapters,
+             SimulatedBleakScanner.printers, _adapters)
+    SimulatedBleakScanner.printers = list(printers)
+    _adapters = {name: SimulatedAdapter(name) for name in (adapters or [None])}
+    ble_printer.BleakClient = SimulatedBleakClient
+    ble_printer.BleakScanner = SimulatedBleakScanner
+    ble_printer.list_adapters = lambda: list(adapters or [None])
+    ble_printer._POOLS.clear()  # Pools bind printers to adapters when created
+    try:
+        yield printers
+    finally:
+        (ble_printer.BleakClient, ble_printer.BleakScanner, ble_printer.list_adapters,
+         SimulatedBleakScanner.printers, _adapters) = saved
+        ble_printer._POOLS.clear()
+
+
+class TcpPrinterSink:
+    """
+    Raw TCP sink standing in for a port-9100 network printer.
+
+    Accepts any number of connections and counts bytes; print_rate (bytes/s)
+    throttles reads so the socket exerts real back-pressure. Use as a context
+    manager or call start()/stop().
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9100, print_rate: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.print_rate = print_rate
+        self.received = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._stop = threading.Event()
+
+    def start(self) -> "TcpPrinterSink":
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        self._sock.listen(16)
+        self._sock.settimeout(0.2)
+        threading.Thread(target=self._accept_loop, name="tcp-printer-sink", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._sock is not None:
+            self._sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn, _addr = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            with self._lock:
+                self.connections += 1
+            threading.Thread(target=self._read_loop, args=(conn,), daemon=True).start()
+
+    def _read_loop(self, conn: socket.socket):
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    data = conn.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                with self._lock:
+                    self.received += len(data)
+                if self.print_rate:
+                    time.sleep(len(data) / self.print_rate)
@@ -0,0 +1,179 @@
+"""
+QR codes and 1D barcodes as ESC/POS commands.
+
+With the printer's own commands (GS ( k for QR, GS k for barcodes) a code
+costs tens of bytes instead of kilobytes of uploaded image raster. Printers
+whose profile lacks them get an exact raster: every module becomes an
+integer number of dots, with no resampling, so codes stay scannable.
+
+The raster fallback uses qrcode and python-barcode (both installed with
+python-escpos), imported only when it is needed.
+"""
+import re
+from typing import List, Sequence
+
+from printer_profile import PROFILE
+from raster_payload import RASTER_MAX_WIDTH
+from ticket_templates import ALIGN_CENTER, ALIGN_LEFT, GS, encode_text, raster_command
+
+
+QR_ERROR_LEVELS = {"L": 48, "M": 49, "Q": 50, "H": 51}
+QR_MAX_BYTES = 7089 - 3  # GS ( k store limit, minus its 3 header bytes
+DEFAULT_QR_MODULE_SIZE = 6  # Dots per module; ~20 mm wide for a short URL
+
+# name -> (GS k function B code, pattern the data must match, python-barcode name)
+BARCODE_SYMBOLOGIES = {
+    "UPC-A": (65, r"\d{11,12}", "upca"),
+    "EAN13": (67, r"\d{12,13}", "ean13"),
+    "EAN8": (68, r"\d{7,8}", "ean8"),
+    "CODE39": (69, r"[0-9A-Z \-.$/+%]{1,40}", "code39"),
+    "ITF": (70, r"(\d\d){1,20}", "itf"),
+    "CODE128": (73, r"[\x20-\x7e]{1,40}", "code128"),
+}
+DEFAULT_BARCODE_HEIGHT = 80  # Dots (10 mm)
+DEFAULT_BARCODE_MODULE_WIDTH = 2  # Dots per narrow bar
+
+
+def _wrap(code: bytes) -> bytes:
+    """Centre a code on its own line."""
+    return ALIGN_CENTER + code + b"\n" + ALIGN_LEFT
+
+
+def _modules_raster(rows: Sequence[str], scale_x: int, scale_y: int) -> bytes:
+    """GS v 0 for a module matrix ('1' = black), each module scale_x by scale_y dots."""
+    width = len(rows[0]) * scale_x
+    bytes_per_line = (width + 7) // 8
+    pad = "0" * (bytes_per_line * 8 - width)
+    body = []
+    for row in rows:
+        bits = "".join(c * scale_x for c in row) + pad
+        body.append(int(bits, 2).to_bytes(bytes_per_line, "big") * scale_y)
+    height = len(rows) * scale_y
+    return raster_command(bytes_per_line, height, b"".join(body))
+
+
+# --- QR ---
+
+def _qr_native(data: bytes, module_size: int, error_level: str) -> bytes:
+    def fn(code: bytes, params: bytes) -> bytes:
+        n = len(params) + 2  # cn + fn
+        return GS + b"(k" + bytes([n & 0xFF, n >> 8, 49]) + code + params
+
+    return (
+        fn(b"A", b"2\x00")  # Model 2
+        + fn(b"C", bytes([module_size]))
+        + fn(b"E", bytes([QR_ERROR_LEVELS[error_level]]))
+        + fn(b"P", b"0" + data)  # Store
+        + fn(b"Q", b"0")  # Print
+    )
+
+
+def _qr_raster(data: bytes, module_size: int, error_level: str) -> bytes:
+    import qrcode
+
+    levels = {
+        "L": qrcode.constants.ERROR_CORRECT_L,
+        "M": qrcode.constants.ERROR_CORRECT_M,
+        "Q": qrcode.constants.ERROR_CORRECT_Q,
+        "H": qrcode.constants.ERROR_CORRECT_H,
+    }
+    qr = qrcode.QRCode(error_correction=levels[error_level], border=0, box_size=1)
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    # Largest whole number of dots per module that fits the paper
+    scale = min(module_size, RASTER_MAX_WIDTH // len(matrix))
+    if scale < 1:
+        raise ValueError("QR code is too large for the paper width")
+    rows = ["".join("1" if m else "0" for m in row) for row in matrix]
+    return _modules_raster(rows, scale, scale)
+
+
+def qr_code(content: str, module_size: int = None, error_level: str = "M", native: bool = None) -> bytes:
+    """A centred QR code. Raises ValueError for content or options the printer can't take."""
+    if not isinstance(content, str):
+        raise ValueError("QR content must be text")
+    data = content.encode("utf-8")
+    if not data:
+        raise ValueError("QR content cannot be empty")
+    if len(data) > QR_MAX_BYTES:
+        raise ValueError(f"QR content is limited to {QR_MAX_BYTES} bytes")
+    module_size = DEFAULT_QR_MODULE_SIZE if module_size is None else int(module_size)
+    if not 1 <= module_size <= 16:
+        raise ValueError("QR module size must be 1-16 dots")
+    error_level = error_level or "M"
+    if not isinstance(error_level, str) or error_level.upper() not in QR_ERROR_LEVELS:
+        raise ValueError("QR error correction must be one of L, M, Q, H")
+    if native is None:
+        native = PROFILE.native_qr
+    error_level = error_level.upper()
+    if native:
+        return _wrap(_qr_native(data, module_size, error_level))
+    return _wrap(_qr_raster(data, module_size, error_level))
+
+
+# --- 1D barcodes ---
+
+# Digits before the check digit, for the symbologies that have one
+_CHECKED_LENGTHS = {"ean13": 12, "ean8": 7, "upca": 11}
+
+
+def _check_digit(digits: str) -> str:
+    """EAN/UPC check digit: weights 3, 1, 3, ... from the right."""
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digits)))
+    return str(-total % 10)
+
+
+def _barcode_native(content: str, code: int, height: int, module_width: int) -> bytes:
+    data = content.encode("ascii")
+    if code == 73:
+        data = b"{B" + data  # CODE128 needs a code set; B covers printable ASCII
+    return (
+        GS + b"H\x02"  # Human-readable text below
+        + GS + b"f\x00"
+        + GS + b"h" + bytes([height])
+        + GS + b"w" + bytes([module_width])
+        + GS + b"k" + bytes([code, len(data)]) + data
+    )
+
+
+def _barcode_raster(content: str, library_name: str, height: int, module_width: int) -> bytes:
+    import barcode
+
+    options = {"add_checksum": False} if library_name == "code39" else {}
+    if library_name in _CHECKED_LENGTHS:
+        content = content[:_CHECKED_LENGTHS[library_name]]  # python-barcode appends the check digit
+    code = barcode.get_barcode_class(library_name)(content, **options)
+    modules: List[str] = code.build()
+    # Quiet zone of 10 modules each side
+    row = "0" * 10 + modules[0] + "0" * 10
+    scale = min(module_width, RASTER_MAX_WIDTH // len(row))
+    if scale < 1:
+        raise ValueError("Barcode is too long for the paper width")
+    return _modules_raster([row], scale, height) + encode_text("\n" + code.get_fullcode())
+
+
+def barcode(content: str, symbology: str = "CODE128", height: int = None, module_width: int = None,
+            native: bool = None) -> bytes:
+    """A centred 1D barcode with its digits printed below."""
+    symbology = symbology or "CODE128"
+    if not isinstance(symbology, str) or symbology.upper() not in BARCODE_SYMBOLOGIES:
+        raise ValueError(f"Barcode symbology must be one of: {', '.join(BARCODE_SYMBOLOGIES)}")
+    symbology = symbology.upper()
+    code, pattern, library_name = BARCODE_SYMBOLOGIES[symbology]
+    if not isinstance(content, str) or not re.fullmatch(pattern, content):
+        raise ValueError(f"Content is not valid for {symbology}")
+    digits = _CHECKED_LENGTHS.get(library_name)
+    if digits and len(content) > digits and content[-1] != _check_digit(content[:digits]):
+        raise ValueError(f"Check digit is wrong for {symbology}")
+    height = DEFAULT_BARCODE_HEIGHT if height is None else int(height)
+    module_width = DEFAULT_BARCODE_MODULE_WIDTH if module_width is None else int(module_width)
+    if not 1 <= height <= 255:
+        raise ValueError("Barcode height must be 1-255 dots")
+    if not 2 <= module_width <= 6:
+        raise ValueError("Barcode module width must be 2-6 dots")
+    if native is None:
+        native = PROFILE.supports_barcode(symbology)
+    if native:
+        return _wrap(_barcode_native(content, code, height, module_width))
+    return _wrap(_barcode_raster(content, library_name, height, module_width))
@@ -0,0 +1,142 @@
+"""
+Image rendering for ESC/POS thermal printers.
+
+Turns uploaded (base64) images into GS v 0 raster commands in separately
+timed stages: decode, composite, resize, contrast, dither and pack. Shared by
+every transport; importing this module is what pulls in PIL, so callers
+import it only when an image is actually printed.
+"""
+import base64
+import io
+import os
+from typing import Optional
+
+from PIL import Image
+
+from job_trace import render_stage
+from ticket_templates import raster_command
+
+
+# Image processing settings
+IMAGE_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "384"))  # 384 for 58mm, 576 for 80mm printers
+IMAGE_MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "800"))  # Limit height to control print time
+IMAGE_USE_DITHERING = os.getenv("IMAGE_USE_DITHERING", "true").lower() in ("true", "1", "yes")
+IMAGE_CONTRAST = float(os.getenv("IMAGE_CONTRAST", "1.5"))  # Contrast boost (1.0 = no change)
+
+
+def resize_to_fit(image: Image.Image, max_width: int, max_height: int) -> Image.Image:
+    """Shrink (never enlarge) to fit within max_width x max_height, keeping aspect ratio."""
+    if image.width > max_width or image.height > max_height:
+        ratio = min(max_width / image.width, max_height / image.height)
+        new_width = int(image.width * ratio)
+        new_height = int(image.height * ratio)
+        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+    return image
+
+
+def enhance_contrast(image: Image.Image, contrast: float) -> Image.Image:
+    """Convert to grayscale and apply the contrast boost thermal printers need."""
+    # Convert to grayscale first for better processing
+    image = image.convert('L')
+    if contrast != 1.0:
+        from PIL import ImageEnhance
+        enhancer = ImageEnhance.Contrast(image)
+        image = enhancer.enhance(contrast)
+    return image
+
+
+def dither(image: Image.Image, use_dithering: bool) -> Image.Image:
+    """Reduce a grayscale image to 1-bit."""
+    if use_dithering:
+        # Floyd-Steinberg dithering - much better for intricate images
+        return image.convert('1', dither=Image.Dither.FLOYDSTEINBERG)
+    # Simple threshold - faster but loses detail
+    return image.convert('1', dither=Image.Dither.NONE)
+
+
+def pack_raster(image: Image.Image) -> bytes:
+    """Wrap a 1-bit image in a GS v 0 raster command."""
+    width = image.width
+    height = image.height
+    
+    # Calculate bytes per line (must be multiple of 8 bits)
+    bytes_per_line = (width + 7) // 8
+    
+    # Fast raster conversion using PIL's tobytes()
+    # Pack pixels into bytes (8 pixels per byte, MSB first)
+    # PIL's '1' mode tobytes gives us packed bits, but we need to invert
+    raw_bytes = image.tobytes()
+    
+    # Invert bits (PIL: 0=black, 1=white; ESC/POS: 1=print/black, 0=white)
+    raster_data = bytes(~b & 0xFF for b in raw_bytes)
+    
+    return raster_command(bytes_per_line, height, raster_data)
+
+
+def image_to_escpos_raster(image: Image.Image, max_width: int = None, max_height: int = None, use_dithering: bool = None, contrast: float = None) -> bytes:
+    """
+    Convert PIL Image to ESC/POS raster bitmap format (GS v 0 command).
+    
+    Args:
+        image: PIL Image to convert
+        max_width: Maximum width in pixels (default 384 for 58mm thermal printers)
+        max_height: Maximum height in pixels (limits print time for tall images)
+        use_dithering: Use Floyd-Steinberg dithering for better detail (default True)
+        contrast: Contrast enhancement factor (1.0 = no change, 1.5 = 50% boost)
+    """
+    # Use env var defaults
+    if max_width is None:
+        max_width = IMAGE_MAX_WIDTH
+    if max_height is None:
+        max_height = IMAGE_MAX_HEIGHT
+    if use_dithering is None:
+        use_dithering = IMAGE_USE_DITHERING
+    if contrast is None:
+        contrast = IMAGE_CONTRAST
+    
+    with render_stage("resize"):
+        image = resize_to_fit(image, max_width, max_height)
+    with render_stage("contrast"):
+        image = enhance_contrast(image, contrast)
+    with render_stage("dither"):
+        image = dither(image, use_dithering)
+    with render_stage("pack"):
+        return pack_raster(image)
+
+
+def decode_image(image_base64: str) -> Image.Image:
+    """Decode a base64 (optionally data-URL) string into a PIL Image."""
+    # Remove data URL prefix if present
+    if ',' in image_base64:
+        image_base64 = image_base64.split(',')[1]
+    
+    image_data = base64.b64decode(image_base64)
+    image = Image.open(io.BytesIO(image_data))
+    image.load()  # Force the decode here so it is timed as such
+    return image
+
+
+def flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """Composite transparency onto white and convert to RGB."""
+    if image.mode in ('RGBA', 'P'):
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        if image.mode == 'RGBA':
+            background.paste(image, mask=image.split()[3])
+        else:
+            background.paste(image)
+        return background
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def process_image_base64(image_base64: str, max_width: int = 384) -> Optional[Image.Image]:
+    """Process base64 image string to PIL Image."""
+    try:
+        with render_stage("decode"):
+            image = decode_image(image_base64)
+        # Handle transparency
+        with render_stage("composite"):
+            return flatten_to_rgb(image)
+    except Exception:
+        return None
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Opt-in job trace recorder and offline replay.
+
+With TRACE_PATH set, every print job is written to a rotating trace file:
+the request body, the final ESC/POS payload, render and transport timings,
+and when each chunk of the payload was written to the printer. A slow or
+garbled ticket from production can then be replayed on a laptop:
+
+    python job_trace.py list traces/jobs.trace --slow 2000
+    python job_trace.py show traces/jobs.trace 3f9c2a1b --payload job.bin
+    python job_trace.py replay traces/jobs.trace --mode render
+    python job_trace.py replay traces/jobs.trace --mode transport --transport ble --speed 4
+
+"render" runs the recorded requests through the current rendering code (no
+printer) and compares render time and payload size with the recording.
+"transport" feeds the recorded payloads through the current scheduler and
+transport code into a simulated printer (ble_sim), at the recorded arrival
+times divided by --speed (0 = back to back), and compares time on the printer.
+
+File format: one JSON object per job, each its own gzip member, appended.
+The file reads as a single gzip stream (zcat works), and a crash can only
+truncate the last record. When the file passes TRACE_MAX_MB it is rotated to
+.1, .2, ... (TRACE_BACKUPS kept). "{pid}" in TRACE_PATH gives each gunicorn
+worker its own file. With PRINTER_DAEMON_SOCKET set, chunk timings are
+recorded only if the daemon is also started with TRACE_PATH.
+"""
+import argparse
+import atexit
+import base64
+import gzip
+import json
+import logging
+import os
+import queue
+import statistics
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+
+from metrics import RENDER_SECONDS, TRANSPORT_SECONDS
+from queued_writer import QueuedWriter
+
+logger = logging.getLogger(__name__)
+
+TRACE_PATH = os.getenv("TRACE_PATH", "").strip()  # Empty = no tracing
+TRACE_MAX_MB = float(os.getenv("TRACE_MAX_MB", "50"))  # Rotate the trace file past this size
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))  # Rotated files kept (.1 is the newest)
+
+FORMAT_VERSION = 1
+
+
+class JobTrace:
+    """What one job did, filled in as it passes through the pipeline."""
+
+    def __init__(self, route: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.route = route
+        self.ts = time.time()
+        self.started = time.perf_counter()
+        self.timings = {}  # name -> ms
+        self.transport: Optional[str] = None
+        self.image = False
+        self.payload: Optional[bytes] = None
+        self.chunks: List[List[float]] = []  # [ms since the first write began, bytes]
+        self._first_write: Optional[float] = None
+
+    def note(self, name: str, seconds: float):
+        self.timings[name] = round(self.timings.get(name, 0.0) + seconds * 1000, 3)
+
+    def to_dict(self, request: Optional[dict], status: int, elapsed: float) -> dict:
+        return {
+            "v": FORMAT_VERSION,
+            "id": self.id,
+            "ts": round(self.ts, 3),
+            "route": self.route,
+            "status": status,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "transport": self.transport,
+            "image": self.image,
+            "timings": self.timings,
+            "chunks": self.chunks,
+            "request": request,
+            "payload": base64.b64encode(self.payload).decode("ascii") if self.payload is not None else None,
+        }
+
+
+_current: ContextVar[Optional[JobTrace]] = ContextVar("job_trace", default=None)
+
+
+# --- Hooks for the pipeline (no-ops unless a job is being traced) ---
+
+@contextmanager
+def render_stage(stage: str):
+    """Time the block into RENDER_SECONDS by stage, also noted in the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        RENDER_SECONDS.observe(elapsed, stage=stage)
+        trace = _current.get()
+        if trace is not None:
+            trace.note(f"render.{stage}", elapsed)
+
+
+@contextmanager
+def transport_op(transport: str, op: str):
+    """Time the block into TRANSPORT_SECONDS by transport and op, also noted in the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        note_transport(transport, op, time.perf_counter() - start)
+
+
+def note_transport(transport: str, op: str, seconds: float):
+    TRANSPORT_SECONDS.observe(seconds, transport=transport, op=op)
+    trace = _current.get()
+    if trace is not None:
+        trace.note(f"transport.{op}", seconds)
+
+
+def note(name: str, seconds: float):
+    """Add a timing (queue wait, time on the printer, ...) to the current trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.note(name, seconds)
+
+
+def payload(data: bytes, transport: str, image: bool):
+    """The final ESC/POS bytes about to be sent. Time since the request began counts as render."""
+    trace = _current.get()
+    if trace is not None:
+        trace.payload = data
+        trace.transport = transport
+        trace.image = image
+        trace.note("render", time.perf_counter() - trace.started)
+
+
+def write_started():
+    trace = _current.get()
+    if trace is not None and trace._first_write is None:
+        trace._first_write = time.perf_counter()
+
+
+def chunk(nbytes: int):
+    """A chunk of the payload has been written to the printer."""
+    trace = _current.get()
+    if trace is not None:
+        now = time.perf_counter()
+        if trace._first_write is None:
+            trace._first_write = now
+        trace.chunks.append([round((now - trace._first_write) * 1000, 3), nbytes])
+
+
+# --- Recorder ---
+
+class TraceRecorder(QueuedWriter):
+    """Appends finished traces to a rotating file from a background thread."""
+
+    def __init__(self, path: str, max_bytes: int = int(TRACE_MAX_MB * 1024 * 1024),
+                 backups: int = TRACE_BACKUPS, max_pending: int = 256):
+        super().__init__("job-trace", max_pending)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def _setup(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush)  # Keep the last jobs of a short run (bench, replay)
+
+    def record(self, record: dict):
+        """Queue a finished job's trace; dropped with a warning if the writer is behind."""
+        try:
+            self._enqueue(record)
+        except queue.Full:
+            logger.warning("Job trace queue full; dropping trace")
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.unlink(self.path)
+
+    def _write(self, records: List[dict]):
+        for record in records:
+            try:
+                data = gzip.compress(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n", 6)
+                try:
+                    if os.path.getsize(self.path) + len(data) > self.max_bytes:
+                        self._rotate()
+                except FileNotFoundError:
+                    pass
+                with open(self.path, "ab") as f:
+                    f.write(data)
+            except Exception as e:
+                logger.error(f"Failed to write job trace: {e}")
+
+
+class _MemoryRecorder:
+    """Keeps traces in a list (replay)."""
+
+    def __init__(self):
+        self.records: List[dict] = []
+
+    def record(self, record: dict):
+        self.records.append(record)
+
+    def flush(self, timeout: float = 5.0):
+        pass
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def recorder():
+    """The process's recorder, or None when TRACE_PATH is not set."""
+    global _recorder
+    if _recorder is None and TRACE_PATH:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TraceRecorder(TRACE_PATH.format(pid=os.getpid()))
+    return _recorder
+
+
+@contextmanager
+def job(route: str):
+    """Trace the job run by the ``with`` block; yields None when tracing is off."""
+    if recorder() is None:
+        yield None
+        return
+    trace = JobTrace(route)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def finish(trace: Optional[JobTrace], request: Optional[dict], status: int, elapsed: float):
+    """Hand a finished job's trace to the recorder."""
+    if trace is not None:
+        recorder().record(trace.to_dict(request, status, elapsed))
+
+
+# --- Reading ---
+
+def read_traces(*paths: str) -> Iterator[dict]:
+    """Records from trace files, oldest file first; a truncated last record is skipped."""
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except (EOFError, zlib.error, gzip.BadGzipFile, json.JSONDecodeError) as e:
+                logger.warning(f"{path}: stopped at a damaged record ({e})")
+
+
+def _trace_files(path: str) -> List[str]:
+    """A trace file plus its rotated backups, oldest first."""
+    files = [path]
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        files.insert(0, f"{path}.{i}")
+        i += 1
+    return [f for f in files if os.path.exists(f)]
+
+
+def _select(args) -> List[dict]:
+    paths = _trace_files(args.trace) if args.rotated else [args.trace]
+    records = []
+    for record in read_traces(*paths):
+        if args.id and not record["id"].startswith(args.id):
+            continue
+        if args.slow and record["elapsed_ms"] < args.slow:
+            continue
+        records.append(record)
+    return records
+
+
+def _summary(record: dict) -> str:
+    timings = record["timings"]
+    size = len(base64.b64decode(record["payload"])) if record.get("payload") else 0
+    wait = timings.get("queue", 0.0)
+    on_printer = timings.get("print", 0.0)
+    return (f"{record['id']}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['ts']))}  "
+            f"{record['route']:<14} {record['status']}  {record['elapsed_ms']:>9.1f} ms  "
+            f"render {timings.get('render', 0.0):>8.1f}  queue {wait:>8.1f}  print {on_printer:>8.1f}  "
+            f"{size:>7} B  {len(record['chunks'])} chunks  {record.get('transport') or '-'}")
+
+
+# --- Replay ---
+
+def _replay_render(records: List[dict]) -> List[dict]:
+    """Re-render each recorded request with the current code; nothing is printed."""
+    import app as app_module
+    import job_trace  # The instance app.py uses, not __main__
+    from ticket_archive import _NullArchive
+
+    captured = {}
+
+    def capture(data: bytes, image: bool = False, priority: int = 0) -> dict:
+        job_trace.payload(data, app_module.PRINTER_TYPE, image)
+        captured["size"] = len(data)
+        return {"estimated_sec": 0.0, "estimated_completion": None}
+
+    app_module.TEST_MODE = False
+    app_module.RATE_LIMIT_ENABLED = False
+    app_module.admission.slo_sec = float("inf")
+    app_module.archive = _NullArchive()  # Replays are not real jobs
+    app_module.send_payload = capture
+    app_module.BLE_PRINTER_ADDR = app_module.BLE_PRINTER_ADDR or "00:00:00:00:00:00"  # Never contacted
+    memory = job_trace._recorder = _MemoryRecorder()
+    client = app_module.app.test_client()
+    results = []
+    for record in records:
+        if record.get("request") is None:
+            continue
+        app_module.PRINTER_TYPE = record.get("transport") or app_module.PRINTER_TYPE
+        captured.clear()
+        response = client.post(f"/{record['route']}", json=record["request"])
+        replayed = memory.records[-1] if memory.records else {"timings": {}}
+        recorded_size = len(base64.b64decode(record["payload"])) if record.get("payload") else 0
+        results.append({
+            "id": record["id"],
+            "recorded_ms": record["timings"].get("render", 0.0),
+            "replayed_ms": replayed["timings"].get("render", 0.0),
+            "recorded_bytes": recorded_size,
+            "replayed_bytes": captured.get("size", 0),
+            "status": response.status_code,
+        })
+    return results
+
+
+def _replay_transport(records: List[dict], transport: str, speed: float, sim_options: dict) -> List[dict]:
+    """Send the recorded payloads through the current scheduler and transport into a simulated printer."""
+    import app as app_module
+    from ble_sim import SimulatedPrinter, TcpPrinterSink, simulated_ble
+
+    records = [r for r in records if r.get("payload")]
+    results = [None] * len(records)
+
+    def one(i: int, record: dict):
+        data = base64.b64decode(record["payload"])
+        started = time.perf_counter()
+        timing = app_module.print_locally(data, image=record.get("image", False))
+        results[i] = {
+            "id": record["id"],
+            "recorded_ms": record["timings"].get("print", 0.0),
+            "replayed_ms": round(timing["service_sec"] * 1000, 3),
+            "recorded_total_ms": round(record["timings"].get("queue", 0.0) + record["timings"].get("print", 0.0), 3),
+            "replayed_total_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def drive():
+        threads = []
+        t0 = records[0]["ts"] if records else 0.0
+        began = time.monotonic()
+        for i, record in enumerate(records):
+            if speed > 0:
+                delay = (record["ts"] - t0) / speed - (time.monotonic() - began)
+                if delay > 0:
+                    time.sleep(delay)
+            t = threading.Thread(target=one, args=(i, record))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+    app_module.PRINTER_DAEMON_SOCKET = ""
+    app_module.PRINTER_TYPE = transport
+    if transport == "ble":
+        printer = SimulatedPrinter(**sim_options)
+        app_module.BLE_PRINTER_ADDR = printer.address
+        with simulated_ble(printer):
+            drive()
+    else:
+        with TcpPrinterSink(port=0, print_rate=sim_options.get("print_rate")) as sink:
+            app_module.NETWORK_HOST = f"127.0.0.1:{sink.port}"
+            drive()
+    return [r for r in results if r is not None]
+
+
+def _report(results: List[dict], recorded: str, replayed: str, as_json: bool):
+    if as_json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        change = (r[replayed] / r[recorded] - 1) * 100 if r[recorded] else 0.0
+        extra = "".join(f"  {k} {v}" for k, v in r.items() if k not in ("id", recorded, replayed))
+        print(f"{r['id']}  recorded {r[recorded]:>9.1f} ms  replayed {r[replayed]:>9.1f} ms  {change:+6.1f}%{extra}")
+    if results:
+        before = statistics.median(r[recorded] for r in results)
+        after = statistics.median(r[replayed] for r in results)
+        print(f"median: recorded {before:.1f} ms, replayed {after:.1f} ms over {len(results)} job(s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("list", "One line per recorded job"),
+                            ("show", "Print one job's record"),
+                            ("replay", "Replay jobs through the current code")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("trace", help="Trace file (TRACE_PATH)")
+        p.add_argument("id", nargs="?", help="Job id or id prefix")
+        p.add_argument("--slow", type=float, default=0, help="Only jobs that took at least this many ms")
+        p.add_argument("--rotated", action="store_true", help="Also read the rotated .1, .2, ... files")
+        if name == "show":
+            p.add_argument("--payload", help="Write the ESC/POS payload to this file")
+            p.add_argument("--chunks", action="store_true", help="List every chunk write")
+        if name == "replay":
+            p.add_argument("--mode", choices=["render", "transport"], default="render")
+            p.add_argument("--transport", choices=["ble", "network"], help="Default: as recorded, else ble")
+            p.add_argument("--speed", type=float, default=1.0, help="Arrival-time speed-up; 0 = back to back")
+            p.add_argument("--mtu", type=int, default=247)
+            p.add_argument("--write-latency", type=float, default=0.0075)
+            p.add_argument("--print-rate", type=float, default=8000.0)
+            p.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    records = _select(args)
+    if args.command == "list":
+        for record in records:
+            print(_summary(record))
+    elif args.command == "show":
+        if not records:
+            parser.error("no matching job")
+        record = records[0]
+        if args.payload and record.get("payload"):
+            with open(args.payload, "wb") as f:
+                f.write(base64.b64decode(record["payload"]))
+        shown = dict(record, payload=f"<{len(base64.b64decode(record['payload']))} bytes>" if record.get("payload") else None)
+        if isinstance(record.get("request"), dict):
+            shown["request"] = {k: f"<{len(v)} chars>" if isinstance(v, str) and len(v) > 200 else v
+                                for k, v in record["request"].items()}
+        if not args.chunks and record["chunks"]:
+            shown["chunks"] = f"<{len(record['chunks'])} writes over {record['chunks'][-1][0]:.1f} ms>"
+        print(json.dumps(shown, indent=2))
+    elif args.mode == "render":
+        _report(_replay_render(records), "recorded_ms", "replayed_ms", args.json)
+    else:
+        options = {"mtu": args.mtu, "write_latency": args.write_latency, "print_rate": args.print_rate}
+        transport = args.transport or next((r["transport"] for r in records if r.get("transport") in ("ble", "network")), "ble")
+        _report(_replay_transport(records, transport, args.speed, options), "recorded_ms", "replayed_ms", args.json)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    raise SystemExit(main())
@@ -0,0 +1,205 @@
+"""
+Lightweight Prometheus-style metrics for the print pipeline.
+
+Counters, gauges and histograms are kept in process memory and rendered in
+the Prometheus text exposition format by the /metrics endpoint.  Recording a
+sample is a dict lookup and a few additions under a lock, so the hooks are
+cheap enough to leave on in production.
+"""
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+
+# Seconds; covers everything from a PIL pack (ms) to a slow BLE scan (tens of s)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down (e.g. queue depth)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed values (usually seconds)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            row[idx] += 1
+            row[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += n
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+def render_latest() -> str:
+    """All registered metrics in the Prometheus text format (version 0.0.4)."""
+    return "\n".join(m.render() for m in _REGISTRY) + "\n"
+
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Print pipeline metrics ---
+
+RENDER_SECONDS = Histogram(
+    "ticket_printer_render_seconds",
+    "Time spent in each image rendering stage.",
+    ["stage"],  # decode, composite, resize, contrast, dither, pack
+)
+TRANSPORT_SECONDS = Histogram(
+    "ticket_printer_transport_seconds",
+    "Time spent talking to the printer, per transport and operation.",
+    ["transport", "op"],  # op: scan, connect, write
+)
+JOB_SECONDS = Histogram(
+    "ticket_printer_job_seconds",
+    "End-to-end time of a print request, from parsing to the last byte written.",
+    ["route", "transport", "outcome"],
+)
+BYTES_SENT = Counter(
+    "ticket_printer_bytes_sent_total",
+    "ESC/POS payload bytes written to the printer.",
+    ["transport"],
+)
+RETRIES = Counter(
+    "ticket_printer_retries_total",
+    "Connection/write attempts retried after a failure.",
+    ["transport"],
+)
+DISCONNECTS = Counter(
+    "ticket_printer_disconnects_total",
+    "Printer connections dropped before the payload was fully written.",
+    ["transport"],
+)
+QUEUE_DEPTH = Gauge(
+    "ticket_printer_queue_depth",
+    "Print jobs accepted but not yet finished.",
+)
+REJECTIONS = Counter(
+    "ticket_printer_rejections_total",
+    "Print requests turned away with 429, by reason.",
+    ["reason"],  # rate_limit, overload
+)
+SCHED_WAIT_SECONDS = Histogram(
+    "ticket_printer_sched_wait_seconds",
+    "Time print jobs waited for their turn on the printer.",
+)
@@ -1,3 +1,5 @@
+const zlib = require('zlib');
+
 exports.handler = async (event, context) => {
   // Only allow POST requests
   if (event.httpMethod !== 'POST') {
@@ -7,6 +9,16 @@ exports.handler = async (event, context) => {
     };
   }
 
+  // Batches from the print server's local archive (ticket_archive.py) arrive
+  // gzip'd as {"tickets": [...]}. Failures there must be reported so the
+  // archive keeps the rows and retries later.
+  const headers = Object.fromEntries(
+    Object.entries(event.headers || {}).map(([k, v]) => [k.toLowerCase(), v])
+  );
+  if (headers['content-encoding'] === 'gzip') {
+    return logBatch(process.env.CONVEX_DEPLOYMENT, event, headers);
+  }
+
   // Get Convex deployment URL from environment variable
   // Required: Set CONVEX_DEPLOYMENT in Netlify environment variables
   const CONVEX_URL = process.env.CONVEX_DEPLOYMENT;
@@ -74,3 +86,59 @@ exports.handler = async (event, context) => {
   }
 };
 
+
+async function logBatch(convexUrl, event, headers) {
+  const expectedToken = process.env.ARCHIVE_SYNC_TOKEN;
+  if (expectedToken && headers['authorization'] !== `Bearer ${expectedToken}`) {
+    return { statusCode: 401, body: JSON.stringify({ error: 'Unauthorized' }) };
+  }
+
+  if (!convexUrl) {
+    return { statusCode: 503, body: JSON.stringify({ error: 'Convex URL not configured' }) };
+  }
+
+  try {
+    const raw = Buffer.from(event.body || '', event.isBase64Encoded ? 'base64' : 'binary');
+    const { tickets = [] } = JSON.parse(zlib.gunzipSync(raw).toString('utf8'));
+
+    // Only tickets that were accepted go to Convex; other print jobs and
+    // rejected or failed submissions stay in the local archive
+    const accepted = tickets.filter((t) => t.route === 'submit_ticket' && t.status != null && t.status < 400);
+    const results = await Promise.allSettled(
+      accepted.map((t) =>
+        fetch(`${convexUrl}/addTicket`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            from_name: t.from_name,
+            question: t.content,
+            timestamp: t.created_at
+          })
+        })
+      )
+    );
+
+    // Report failures per ticket, so the archive resends only those and the
+    // tickets already inserted are not duplicated on retry
+    const failed = accepted
+      .filter((t, i) => results[i].status === 'rejected' || !results[i].value.ok)
+      .map((t) => t.id);
+    if (failed.length && failed.length === accepted.length) {
+      const first = results[0];
+      throw new Error(`Convex error: ${first.status === 'rejected' ? first.reason.message : first.value.statusText}`);
+    }
+
+    return {
+      statusCode: 200,
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ success: true, stored: accepted.length - failed.length, failed })
+    };
+  } catch (error) {
+    console.error('Error logging ticket batch:', error);
+    return {
+      statusCode: 502,
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ success: false, error: error.message })
+    };
+  }
+}
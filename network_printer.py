@@ -0,0 +1,225 @@
+"""
+Persistent raw-TCP transport for network (port 9100) printers.
+
+python-escpos's Network opens a new blocking socket per job and has no
+write timeout. Here one asyncio loop, running on a background thread, keeps
+a connection open to each printer in NETWORK_HOST:
+
+  - TCP keepalive, so a printer that was switched off is noticed
+  - payloads are written with writelines and awaited with drain(), so a busy
+    printer pushes back (NETWORK_WRITE_TIMEOUT_SEC bounds a stalled one)
+  - a dropped connection is reopened on the next job; a job that fails on a
+    connection that had gone stale is retried once on a fresh one
+  - idle connections are closed after NETWORK_IDLE_CLOSE_SEC, since many
+    printers accept only one client at a time
+  - prepare() opens the connections ahead of a job, without waiting
+
+NETWORK_HOST may list several printers ("10.0.0.5,10.0.0.6:9101"); each job
+goes to the printer with the fewest jobs in flight.
+"""
+import asyncio
+import logging
+import os
+import socket
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from metrics import DISCONNECTS, RETRIES
+from printer_pool import LoopThread, PrinterPool
+
+logger = logging.getLogger(__name__)
+
+NETWORK_PORT = int(os.getenv("NETWORK_PORT", "9100"))
+NETWORK_CONNECT_TIMEOUT_SEC = float(os.getenv("NETWORK_CONNECT_TIMEOUT_SEC", "5"))
+NETWORK_WRITE_TIMEOUT_SEC = float(os.getenv("NETWORK_WRITE_TIMEOUT_SEC", "60"))  # A stalled printer (paper out)
+NETWORK_IDLE_CLOSE_SEC = float(os.getenv("NETWORK_IDLE_CLOSE_SEC", "60"))
+NETWORK_BUFFER_HIGH = 64 * 1024  # Bytes queued in the transport before drain() waits
+
+
+class PrinterUnreachable(ConnectionError):
+    """Could not connect to a printer; nothing was sent, so another may take the job."""
+
+
+def parse_hosts(spec: str, default_port: int = NETWORK_PORT) -> List[Tuple[str, int]]:
+    """'host[:port],host[:port]' -> [(host, port), ...]."""
+    hosts = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        host, sep, port = item.rpartition(":")
+        if sep and port.isdigit() and "]" not in port:
+            hosts.append((host.strip("[]"), int(port)))
+        else:
+            hosts.append((item.strip("[]"), default_port))
+    return hosts
+
+
+_loop = LoopThread("network-printer")
+
+
+def _set_keepalive(sock: socket.socket):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+class _PrinterConnection:
+    """One printer's connection. Lives on the transport loop."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        if self.connected:
+            return
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), NETWORK_CONNECT_TIMEOUT_SEC
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            raise PrinterUnreachable(f"{self.host}:{self.port}: {str(e) or 'connect timed out'}") from e
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            _set_keepalive(sock)
+        writer.transport.set_write_buffer_limits(high=NETWORK_BUFFER_HIGH)
+        self._writer = writer
+        asyncio.ensure_future(self._watch(reader, writer))
+        logger.info(f"Connected to network printer {self.host}:{self.port}")
+
+    async def _watch(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Printers may send status bytes; discard them and notice when the peer closes
+        try:
+            while await reader.read(1024):
+                pass
+        except (OSError, ConnectionError):
+            pass
+        if self._writer is writer:
+            logger.info(f"Network printer {self.host}:{self.port} closed the connection")
+            self._close()
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _idle_close(self):
+        if self.connected and (self._lock is None or not self._lock.locked()):
+            logger.info(f"Closing idle connection to {self.host}:{self.port}")
+            self._close()
+
+    def _arm_idle_close(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        if NETWORK_IDLE_CLOSE_SEC > 0:
+            self._idle_timer = asyncio.get_running_loop().call_later(NETWORK_IDLE_CLOSE_SEC, self._idle_close)
+
+    async def warm(self):
+        """Connect ahead of a job or for a health check; closed again after NETWORK_IDLE_CLOSE_SEC without one."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return  # A job is using the connection
+        async with self._lock:
+            await self.connect()
+            self._arm_idle_close()
+
+    async def send(self, payload: bytes):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            for attempt in (1, 2):
+                reused = self.connected
+                await self.connect()
+                try:
+                    self._writer.writelines([payload])
+                    await asyncio.wait_for(self._writer.drain(), NETWORK_WRITE_TIMEOUT_SEC)
+                    break
+                except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                    DISCONNECTS.inc(transport="network")
+                    self._close()
+                    # Only a stale reused connection is worth a retry; a timeout
+                    # means the printer took bytes and stalled, so resending would duplicate
+                    if attempt == 2 or not reused or isinstance(e, asyncio.TimeoutError):
+                        raise
+                    RETRIES.inc(transport="network")
+                    logger.info(f"Stale connection to {self.host}:{self.port} ({e}); reconnecting")
+            self._arm_idle_close()
+
+
+class NetworkPrinterPool(PrinterPool):
+    """Persistent connections to one or more network printers, usable from any thread."""
+
+    unreachable = (PrinterUnreachable,)
+
+    def __init__(self, hosts: List[Tuple[str, int]]):
+        if not hosts:
+            raise ValueError("No network printer configured (NETWORK_HOST)")
+        self.printers = [_PrinterConnection(host, port) for host, port in hosts]
+        super().__init__(len(self.printers))
+
+    def _connected(self, index: int) -> bool:
+        return self.printers[index].connected
+
+    def check(self) -> bool:
+        """Connect to any printer not yet connected (closed again when idle); True if at least one is reachable."""
+        async def connect_all():
+            results = await asyncio.gather(*(p.warm() for p in self.printers), return_exceptions=True)
+            return any(p.connected for p in self.printers), results
+
+        reachable, results = _loop.run(connect_all(), NETWORK_CONNECT_TIMEOUT_SEC + 5)
+        for printer, result in zip(self.printers, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Network printer {printer.host}:{printer.port} unreachable: {result}")
+        return reachable
+
+    def prepare(self):
+        """Start connecting to every printer for a job that is about to come; does not wait."""
+        async def warm_all():
+            results = await asyncio.gather(*(p.warm() for p in self.printers), return_exceptions=True)
+            for printer, result in zip(self.printers, results):
+                if isinstance(result, Exception):
+                    logger.info(f"Could not connect to {printer.host}:{printer.port} ahead of a job: {result}")
+
+        _loop.spawn(warm_all())
+
+    def send(self, payload: bytes):
+        """Write one complete payload to the least busy printer; blocks until drained."""
+        timeout = NETWORK_WRITE_TIMEOUT_SEC + 2 * NETWORK_CONNECT_TIMEOUT_SEC + 5
+        self._least_busy(lambda index: _loop.run(self.printers[index].send(payload), timeout))
+
+
+_POOLS: Dict[Tuple[Tuple[str, int], ...], NetworkPrinterPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host_spec: str, port: int = NETWORK_PORT) -> NetworkPrinterPool:
+    """The shared pool for a NETWORK_HOST value."""
+    hosts = tuple(parse_hosts(host_spec, port))
+    with _pools_lock:
+        pool = _POOLS.get(hosts)
+        if pool is None:
+            pool = _POOLS[hosts] = NetworkPrinterPool(list(hosts))
+    return pool
+
+
+class PooledNetworkPrinter:
+    """The slice of the python-escpos printer interface app.py uses, over a pool."""
+
+    def __init__(self, pool: NetworkPrinterPool):
+        self.pool = pool
+
+    def _raw(self, payload: bytes):
+        self.pool.send(payload)
+
+    def close(self):
+        pass  # The connection stays open for the next job
@@ -0,0 +1,101 @@
+"""
+Per-band print heat from black-dot density.
+
+Thermal heads slow down on dense black: they heat a limited number of dots
+per strike, so a solid row takes many strikes while a sparse row takes one.
+With a fixed setting, a text ticket prints as slowly as a contrast-boosted
+photo. For printers whose profile has heat levels (ESC 7), every GS v 0
+raster in a payload is split into HEAT_BAND_ROWS-row bands, each band's
+share of black dots is measured, and the light, medium or dense setting is
+sent before it (only when it changes). Text prints at the light setting,
+and QR codes and barcodes the printer draws itself (GS ( k, GS k) at the
+dense one, so they scan. Dense is the printer's factory setting, restored
+at the end of the job, so no band prints slower than it would have
+without this.
+"""
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from printer_profile import PROFILE
+from ticket_templates import GS, INIT, count_dots, raster_blocks, raster_command
+
+HEAT_BAND_ROWS = int(os.getenv("HEAT_BAND_ROWS", "48"))  # Dot rows per density band (6 mm)
+HEAT_LIGHT_MAX = float(os.getenv("HEAT_LIGHT_MAX", "0.15"))  # Up to this share of black dots: light
+HEAT_DENSE_MIN = float(os.getenv("HEAT_DENSE_MIN", "0.40"))  # From this share: dense
+
+LIGHT, MEDIUM, DENSE = 0, 1, 2
+
+# The printer draws these itself (escpos_codes); they print dense so they scan
+_NATIVE_CODES = (GS + b"(k", GS + b"k")
+
+
+def density_level(density: float) -> int:
+    if density <= HEAT_LIGHT_MAX:
+        return LIGHT
+    if density >= HEAT_DENSE_MIN:
+        return DENSE
+    return MEDIUM
+
+
+def _bands(data: bytes, bytes_per_line: int, height: int, band_rows: int) -> List[Tuple[int, int, int]]:
+    """(level, first row, rows) runs, adjacent bands of the same level merged."""
+    runs: List[Tuple[int, int, int]] = []
+    for row in range(0, height, band_rows):
+        rows = min(band_rows, height - row)
+        band = data[row * bytes_per_line:(row + rows) * bytes_per_line]
+        level = density_level(count_dots(band) / (len(band) * 8 or 1))
+        if runs and runs[-1][0] == level:
+            runs[-1] = (level, runs[-1][1], runs[-1][2] + rows)
+        else:
+            runs.append((level, row, rows))
+    return runs
+
+
+def _native_code_start(text: bytes) -> int:
+    """Offset of the first native QR code or barcode command in a text segment, or -1."""
+    found = [i for i in (text.find(marker) for marker in _NATIVE_CODES) if i >= 0]
+    return min(found) if found else -1
+
+
+def adapt_heat(payload: bytes, heat_levels: Optional[Sequence[bytes]] = None,
+               band_rows: int = HEAT_BAND_ROWS) -> bytes:
+    """The payload with heat commands before each band whose density level differs from the last."""
+    if heat_levels is None:
+        heat_levels = PROFILE.heat_levels
+    if not heat_levels:
+        return payload
+
+    out = bytearray()
+    current = None
+
+    def set_level(level: int):
+        nonlocal current
+        if level != current:
+            out.extend(heat_levels[level])
+            current = level
+
+    def add_text(text: bytes):
+        code = _native_code_start(text)
+        lines = text if code < 0 else text[:code]
+        if b"\n" in lines:
+            set_level(LIGHT)
+        out.extend(lines)
+        if code >= 0:
+            set_level(DENSE)
+            out.extend(text[code:])
+
+    pos = 0
+    if payload.startswith(INIT):
+        out += INIT  # ESC @ may reset the heat setting, so it goes first
+        pos = len(INIT)
+    for block in raster_blocks(payload):  # A truncated raster ends up in the rest, untouched
+        add_text(payload[pos:block.start])
+        data = payload[block.start + 8:block.end]
+        for level, row, rows in _bands(data, block.bytes_per_line, block.height, band_rows):
+            set_level(level)
+            band = data[row * block.bytes_per_line:(row + rows) * block.bytes_per_line]
+            out += raster_command(block.bytes_per_line, rows, band, block.mode)
+        pos = block.end
+    add_text(payload[pos:])
+    out += heat_levels[DENSE]
+    return bytes(out)
@@ -0,0 +1,255 @@
+"""
+Print-time estimates and shortest-job-first scheduling for the printer.
+
+A quick text note should not wait behind a tall photo trickling out over
+BLE. Every payload is measured (bytes, paper rows, black dots in its raster
+blocks) and a per-transport cost model predicts how long it will hold the
+printer:
+
+    seconds = setup + bytes / throughput + rows * feed_time + dots * burn_time
+
+The model starts from rough per-transport priors and is refitted from every
+completed job (least squares, ridge-regularized toward the priors, with a
+forgetting factor so it follows a weakening battery or a new printer).
+
+The scheduler hands the printer to waiting jobs in priority order, then
+shortest estimate first. Waiting time is subtracted from a job's estimate
+(SCHED_AGING seconds per second waited), so long jobs still get their turn.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from metrics import SCHED_WAIT_SECONDS
+from ticket_templates import RASTER, count_dots, raster_blocks
+
+logger = logging.getLogger(__name__)
+
+SCHED_AGING = float(os.getenv("SCHED_AGING", "0.5"))  # Estimate seconds forgiven per second waited
+SCHED_FORGETTING = float(os.getenv("SCHED_FORGETTING", "0.98"))  # Weight kept by older jobs per new one
+SCHED_PRIOR_WEIGHT = float(os.getenv("SCHED_PRIOR_WEIGHT", "1"))  # Jobs' worth of trust in the priors
+# Per-route priority, e.g. "submit_ticket=1" puts guest tickets ahead of notes; default 0
+SCHED_ROUTE_PRIORITY = os.getenv("SCHED_ROUTE_PRIORITY", "").strip()
+
+LINE_ROWS = 34  # Default ESC/POS line spacing (1/6 inch) in dots at 203 dpi
+
+# (setup seconds, link bytes/s) before any job has completed on the transport
+_PRIORS = {
+    "ble": (3.0, 1500.0),  # Scan + connect, then small GATT writes with gaps
+    "bluetooth": (1.0, 8000.0),
+    "serial": (0.2, 11000.0),  # 115200 baud
+    "usb": (0.2, 50000.0),
+    "network": (0.3, 50000.0),
+}
+_PRIOR_ROW_SEC = 1 / 400.0  # Paper feed, ~50 mm/s at 8 dots/mm
+_PRIOR_DOT_SEC = 5e-6  # Heads slow down to burn dense rows
+
+# Features are scaled to similar magnitudes to keep the fit well-conditioned
+_SCALES = (1.0, 1000.0, 100.0, 10000.0)  # setup, bytes, rows, dots
+
+
+class PayloadStats:
+    """What a payload asks of the printer."""
+
+    __slots__ = ("bytes", "rows", "dots")
+
+    def __init__(self, nbytes: int, rows: int, dots: int):
+        self.bytes = nbytes
+        self.rows = rows
+        self.dots = dots
+
+    def features(self) -> Tuple[float, ...]:
+        return tuple(v / s for v, s in zip((1, self.bytes, self.rows, self.dots), _SCALES))
+
+
+def payload_stats(payload: bytes) -> PayloadStats:
+    """Scan an ESC/POS payload: GS v 0 blocks give rows and dots, text lines give rows."""
+    rows = dots = text_lines = 0
+    pos = 0
+    for block in raster_blocks(payload):
+        text_lines += payload.count(b"\n", pos, block.start)
+        rows += block.height
+        dots += count_dots(payload[block.start + 8:block.end])
+        pos = block.end
+    truncated = payload.find(RASTER, pos)  # A cut-off raster's bytes are not text
+    text_lines += payload.count(b"\n", pos, len(payload) if truncated < 0 else truncated)
+    return PayloadStats(len(payload), rows + text_lines * LINE_ROWS, dots)
+
+
+def _solve(a: List[List[float]], b: List[float]) -> List[float]:
+    """Gaussian elimination with partial pivoting for the small normal equations."""
+    n = len(b)
+    m = [row[:] + [b[i]] for i, row in enumerate(a)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            raise ValueError("singular")
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f * m[col][c]
+    x = [0.0] * n
+    for r in range(n - 1, -1, -1):
+        x[r] = (m[r][n] - sum(m[r][c] * x[c] for c in range(r + 1, n))) / m[r][r]
+    return x
+
+
+class _TransportModel:
+    """Ridge least squares toward the prior, with exponential forgetting."""
+
+    def __init__(self, prior: Sequence[float], prior_weight: float, forgetting: float):
+        self.prior = list(prior)
+        self.forgetting = forgetting
+        n = len(prior)
+        self._a0 = [[prior_weight if i == j else 0.0 for j in range(n)] for i in range(n)]
+        self._b0 = [prior_weight * p for p in prior]
+        self._a = [row[:] for row in self._a0]
+        self._b = self._b0[:]
+        self.coef = self.prior[:]
+        self.samples = 0
+
+    def predict(self, x: Sequence[float]) -> float:
+        return max(0.05, sum(c * v for c, v in zip(self.coef, x)))
+
+    def observe(self, x: Sequence[float], seconds: float):
+        f = self.forgetting
+        n = len(x)
+        for i in range(n):
+            for j in range(n):
+                self._a[i][j] = f * (self._a[i][j] - self._a0[i][j]) + self._a0[i][j] + x[i] * x[j]
+            self._b[i] = f * (self._b[i] - self._b0[i]) + self._b0[i] + x[i] * seconds
+        try:
+            self.coef = _solve(self._a, self._b)
+        except ValueError:
+            return
+        self.samples += 1
+
+
+class CostModel:
+    """Per-transport (and text vs image, whose chunking differs) print-time model."""
+
+    def __init__(self, prior_weight: float = SCHED_PRIOR_WEIGHT, forgetting: float = SCHED_FORGETTING):
+        self.prior_weight = prior_weight
+        self.forgetting = forgetting
+        self._models: Dict[Tuple[str, bool], _TransportModel] = {}
+        self._lock = threading.Lock()
+
+    def _model(self, transport: str, image: bool) -> _TransportModel:
+        key = (transport, image)
+        model = self._models.get(key)
+        if model is None:
+            setup, bytes_per_sec = _PRIORS.get(transport, (1.0, 10000.0))
+            if transport == "ble" and image:
+                bytes_per_sec *= 6  # 200-byte chunks with a shorter gap instead of 20-byte ones
+            prior = (setup, _SCALES[1] / bytes_per_sec, _PRIOR_ROW_SEC * _SCALES[2], _PRIOR_DOT_SEC * _SCALES[3])
+            model = self._models[key] = _TransportModel(prior, self.prior_weight, self.forgetting)
+        return model
+
+    def estimate(self, stats: PayloadStats, transport: str, image: bool = False) -> float:
+        with self._lock:
+            return self._model(transport, image).predict(stats.features())
+
+    def observe(self, stats: PayloadStats, transport: str, image: bool, seconds: float):
+        """Refit from a completed job's actual time on the printer."""
+        with self._lock:
+            model = self._model(transport, image)
+            predicted = model.predict(stats.features())
+            model.observe(stats.features(), seconds)
+        logger.debug(f"Print took {seconds:.2f}s, estimated {predicted:.2f}s ({transport})")
+
+
+def _parse_priorities(spec: str) -> Dict[str, int]:
+    priorities = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, value = item.partition("=")
+        try:
+            priorities[route.strip()] = int(value)
+        except ValueError:
+            logger.warning(f"Ignoring bad SCHED_ROUTE_PRIORITY entry: {item!r}")
+    return priorities
+
+
+_ROUTE_PRIORITIES = _parse_priorities(SCHED_ROUTE_PRIORITY)
+
+
+def route_priority(route: str) -> int:
+    """Scheduling priority for jobs from `route` (higher runs first)."""
+    return _ROUTE_PRIORITIES.get(route, 0)
+
+
+class PrintJob:
+    __slots__ = ("estimate", "priority", "enqueued", "started")
+
+    def __init__(self, estimate: float, priority: int = 0):
+        self.estimate = estimate
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.started: Optional[float] = None
+
+    def key(self, now: float, aging: float) -> Tuple[int, float]:
+        return (-self.priority, self.estimate - aging * (now - self.enqueued))
+
+
+class PrintScheduler:
+    """
+    Grants the printer(s) to one job per printer at a time: priority, then
+    shortest (aged) estimate. capacity > 1 for a pool of network printers.
+    """
+
+    def __init__(self, aging: float = SCHED_AGING, capacity: int = 1):
+        self.aging = aging
+        self.capacity = max(1, capacity)
+        self._cond = threading.Condition()
+        self._waiting: List[PrintJob] = []
+        self._running: List[PrintJob] = []
+
+    def _next(self, now: float) -> PrintJob:
+        return min(self._waiting, key=lambda j: j.key(now, self.aging))
+
+    def _remaining(self, now: float) -> float:
+        return sum(max(0.0, j.estimate - (now - j.started)) for j in self._running)
+
+    def _wait_ahead(self, job: PrintJob, now: float) -> float:
+        """Estimated seconds until `job` would start, if no better job arrives."""
+        if len(self._running) + len(self._waiting) < self.capacity:
+            return 0.0
+        key = job.key(now, self.aging)
+        ahead = sum(j.estimate for j in self._waiting if j is not job and j.key(now, self.aging) < key)
+        return (self._remaining(now) + ahead) / self.capacity
+
+    def backlog_sec(self) -> float:
+        """Estimated seconds of work queued or running, per printer."""
+        with self._cond:
+            now = time.monotonic()
+            return (self._remaining(now) + sum(j.estimate for j in self._waiting)) / self.capacity
+
+    def quote(self, job: PrintJob) -> datetime:
+        """When `job` would finish if queued now (wait for the jobs ahead of it + its own estimate)."""
+        with self._cond:
+            ahead = self._wait_ahead(job, time.monotonic())
+        return datetime.now() + timedelta(seconds=ahead + job.estimate)
+
+    @contextmanager
+    def turn(self, job: PrintJob):
+        """Queue `job` and block until it is its turn on a printer; held for the ``with`` block."""
+        with self._cond:
+            self._waiting.append(job)
+            while len(self._running) >= self.capacity or self._next(time.monotonic()) is not job:
+                self._cond.wait()
+            self._waiting.remove(job)
+            job.started = time.monotonic()
+            self._running.append(job)
+            if self._waiting and len(self._running) < self.capacity:
+                self._cond.notify_all()  # Another printer is free for the next job
+        SCHED_WAIT_SECONDS.observe(job.started - job.enqueued)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running.remove(job)
+                self._cond.notify_all()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Printer-owner daemon for running the web app with several workers.
+
+Under gunicorn each worker would otherwise open its own USB handle or BLE
+connection, and they fight over a device that only takes one at a time.
+With PRINTER_DAEMON_SOCKET set, web workers still parse requests and render
+ESC/POS bytes themselves (that part scales with workers), but hand the
+finished payload to this daemon over a Unix domain socket. The daemon is
+the only process that touches the printer; jobs from all workers share
+one scheduler queue (print_scheduler).
+
+Wire format (both directions): 4-byte big-endian length + JSON header.
+A print request carries its payload either inline after the header (small
+text tickets) or, above PRINTER_DAEMON_INLINE_MAX bytes, in a memfd whose
+file descriptor is passed with SCM_RIGHTS, so image rasters are not pushed
+through the socket.
+
+Usage:
+    python printer_daemon.py                      # serve on PRINTER_DAEMON_SOCKET
+    PRINTER_DAEMON_SOCKET=/run/ticket-printer/printer.sock gunicorn -w 4 app:app
+"""
+import argparse
+import json
+import logging
+import mmap
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import time
+
+import job_trace
+from admission import Overloaded
+
+logger = logging.getLogger(__name__)
+
+PRINTER_DAEMON_SOCKET = os.getenv("PRINTER_DAEMON_SOCKET", "").strip()  # Empty = web process prints directly
+PRINTER_DAEMON_TIMEOUT_SEC = float(os.getenv("PRINTER_DAEMON_TIMEOUT_SEC", "300"))  # Queue wait + print
+PRINTER_DAEMON_INLINE_MAX = int(os.getenv("PRINTER_DAEMON_INLINE_MAX", "65536"))  # Larger payloads go by fd
+
+DEFAULT_SOCKET = "/tmp/ticket-printer.sock"
+_LENGTH = struct.Struct(">I")
+
+
+class PrinterDaemonError(RuntimeError):
+    """The daemon could not be reached or reported a failed job."""
+
+
+# --- Framing ---
+
+def _send_message(sock: socket.socket, header: dict, body: bytes = b"", fds=()):
+    data = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    message = _LENGTH.pack(len(data)) + data + body
+    if fds:
+        # Ancillary data rides on the first bytes; the rest is a plain send
+        sent = socket.send_fds(sock, [message], list(fds))
+        message = message[sent:]
+    if message:
+        sock.sendall(message)
+
+
+def _recv_exact(sock: socket.socket, n: int, buffered: bytearray) -> bytes:
+    while len(buffered) < n:
+        chunk = sock.recv(max(65536, n - len(buffered)))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message")
+        buffered += chunk
+    data = bytes(buffered[:n])
+    del buffered[:n]
+    return data
+
+
+def _recv_message(sock: socket.socket):
+    """(header dict, remaining buffered bytes, received fds)."""
+    first, fds, _flags, _addr = socket.recv_fds(sock, 65536, 1)
+    if not first:
+        raise ConnectionError("Connection closed")
+    buffered = bytearray(first)
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size, buffered))
+    header = json.loads(_recv_exact(sock, length, buffered))
+    return header, buffered, fds
+
+
+def _payload_fd(payload: bytes) -> int:
+    """An anonymous in-memory file holding the payload, rewound to the start."""
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("ticket-job", os.MFD_CLOEXEC)
+    else:
+        fd = os.dup(tempfile.TemporaryFile().fileno())
+    os.write(fd, payload)
+    os.lseek(fd, 0, os.SEEK_SET)
+    return fd
+
+
+# --- Client (used by the web workers) ---
+
+def _request(socket_path: str, header: dict, payload: bytes = b"", timeout: float = PRINTER_DAEMON_TIMEOUT_SEC) -> dict:
+    fd = None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            if len(payload) > PRINTER_DAEMON_INLINE_MAX:
+                fd = _payload_fd(payload)
+                _send_message(sock, dict(header, size=len(payload), fd=True), fds=[fd])
+            else:
+                _send_message(sock, dict(header, size=len(payload)), payload)
+            reply, _rest, _fds = _recv_message(sock)
+    except (OSError, ValueError) as e:
+        raise PrinterDaemonError(f"Printer daemon unavailable: {e}") from e
+    finally:
+        if fd is not None:
+            os.close(fd)
+    if not reply.get("ok"):
+        if reply.get("retry_after") is not None:
+            raise Overloaded(reply["retry_after"])  # The daemon's queue is full; the worker answers 429
+        raise PrinterDaemonError(reply.get("error") or "Print failed")
+    return reply
+
+
+def submit(socket_path: str, payload: bytes, image: bool = False, priority: int = 0) -> dict:
+    """Print a rendered ESC/POS payload via the daemon. Returns the job timing from app.print_locally."""
+    reply = _request(socket_path, {"op": "print", "image": image, "priority": priority}, payload)
+    return reply["timing"]
+
+
+def health(socket_path: str, timeout: float = 30.0) -> bool:
+    """Whether the daemon's printer is reachable."""
+    return bool(_request(socket_path, {"op": "health"}, timeout=timeout)["printer_connected"])
+
+
+def prepare(socket_path: str, timeout: float = 5.0):
+    """Have the daemon start connecting to its printer ahead of a job."""
+    _request(socket_path, {"op": "prepare"}, timeout=timeout)
+
+
+# --- Server ---
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            header, buffered, fds = _recv_message(self.request)
+        except (OSError, ValueError, ConnectionError) as e:
+            logger.warning(f"Bad request on printer socket: {e}")
+            return
+        try:
+            reply = self.server.dispatch(header, self.request, buffered, fds)
+        except Overloaded as e:
+            reply = {"ok": False, "error": str(e), "retry_after": e.retry_after}
+        except Exception as e:
+            logger.error(f"Printer daemon job failed: {e}")
+            reply = {"ok": False, "error": str(e)}
+        finally:
+            for fd in fds:
+                os.close(fd)
+        try:
+            _send_message(self.request, reply)
+        except OSError:
+            pass  # Client gave up waiting
+
+
+class PrinterDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Owns the printer; jobs from all web workers share its scheduler."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, printer_app):
+        self.printer_app = printer_app
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # Stale socket from a previous run
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, header: dict, sock: socket.socket, buffered: bytearray, fds) -> dict:
+        op = header.get("op")
+        if op == "health":
+            return {"ok": True, "printer_connected": self.printer_app.printer_connected()}
+        if op == "prepare":
+            self.printer_app.prepare_printer()
+            return {"ok": True}
+        if op != "print":
+            return {"ok": False, "error": f"Unknown op: {op!r}"}
+
+        size = int(header.get("size", 0))
+        if header.get("fd"):
+            if not fds:
+                return {"ok": False, "error": "Payload descriptor missing"}
+            with mmap.mmap(fds[0], size, prot=mmap.PROT_READ) as mapped:
+                payload = mapped[:]
+        else:
+            payload = _recv_exact(sock, size, buffered)
+
+        started = time.perf_counter()
+        image = bool(header.get("image"))
+        status = 500
+        # With TRACE_PATH set here too, the daemon records the transport side of each job
+        with job_trace.job("daemon") as trace:
+            try:
+                job_trace.payload(payload, self.printer_app.PRINTER_TYPE, image)
+                timing = self.printer_app.print_locally(payload, image=image, priority=int(header.get("priority", 0)))
+                status = 200
+            finally:
+                job_trace.finish(trace, None, status, time.perf_counter() - started)
+        logger.info(f"Finished {size}-byte job in {time.perf_counter() - started:.2f}s")
+        return {"ok": True, "timing": timing}
+
+    def server_close(self):
+        path = self.server_address
+        super().server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=PRINTER_DAEMON_SOCKET or DEFAULT_SOCKET)
+    args = parser.parse_args(argv)
+
+    # The daemon prints with app.py's printer configuration, in this process
+    os.environ["PRINTER_DAEMON_SOCKET"] = ""
+    import app as printer_app
+
+    printer_app.PRINTER_DAEMON_SOCKET = ""
+    server = PrinterDaemon(args.socket, printer_app)
+    logger.info(f"Printer daemon ({printer_app.PRINTER_TYPE}) listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(main())
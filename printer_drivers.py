@@ -0,0 +1,68 @@
+"""
+Printer driver registry.
+
+Each PRINTER_TYPE maps to a factory registered with @register_driver. The
+factories import their backend (python-escpos, bleak, ...) on first use, so
+the server only pays for the driver it is actually configured with. This
+matters on a Pi Zero, where importing every transport at startup made
+service restarts and worker forks noticeably slow.
+
+A factory takes the printer settings as keyword arguments and returns a
+python-escpos printer object, or None for transports that do not use one
+(BLE talks to the printer through ble_printer instead).
+"""
+from typing import Callable, Dict, Optional
+
+
+_DRIVERS: Dict[str, Callable[..., Optional[object]]] = {}
+
+
+def register_driver(name: str):
+    """Decorator registering a printer factory under a PRINTER_TYPE name."""
+    def decorator(factory: Callable[..., Optional[object]]):
+        _DRIVERS[name] = factory
+        return factory
+    return decorator
+
+
+def open_printer(name: str, **settings) -> Optional[object]:
+    """Create the printer for PRINTER_TYPE `name`, importing its backend lazily."""
+    factory = _DRIVERS.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown printer type: {name}")
+    return factory(**settings)
+
+
+@register_driver("usb")
+def _usb(usb_vendor: int = None, usb_product: int = None, **_):
+    from escpos.printer import Usb
+    if usb_vendor and usb_product:
+        return Usb(usb_vendor, usb_product)
+    return Usb(0x0416, 0x5011)
+
+
+@register_driver("serial")
+def _serial(serial_port: str = "/dev/ttyUSB0", **_):
+    from escpos.printer import Serial
+    return Serial(devfile=serial_port, baudrate=9600)
+
+
+@register_driver("bluetooth")
+def _bluetooth(**_):
+    # Classic Bluetooth SPP via rfcomm (NOT BLE)
+    from escpos.printer import Serial
+    return Serial(devfile="/dev/rfcomm0", baudrate=9600)
+
+
+@register_driver("network")
+def _network(network_host: str = "192.168.1.100", network_port: int = 9100, **_):
+    # Persistent asyncio connections shared by all jobs, not escpos's socket per job.
+    # Not probed here: the pool connects on send and skips printers it can't reach.
+    import network_printer
+    return network_printer.PooledNetworkPrinter(network_printer.get_pool(network_host, network_port))
+
+
+@register_driver("ble")
+def _ble(**_):
+    # BLE does not use escpos Serial/Usb objects; see ble_printer
+    return None
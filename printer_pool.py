@@ -0,0 +1,105 @@
+"""
+Shared plumbing for transports that keep printer connections open on a
+background asyncio loop (network_printer, ble_printer).
+
+LoopThread runs one event loop on a daemon thread, started on first use
+(after any worker fork), and lets web threads run coroutines on it.
+PrinterPool spreads jobs over several printers: each goes to the one with
+the fewest jobs in flight, preferring one that is already connected, and a
+printer that can't be reached hands the job to the next.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import threading
+from typing import Callable, Optional, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+
+class LoopThread:
+    """An asyncio event loop on its own daemon thread."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name=self.name, daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def spawn(self, coro) -> concurrent.futures.Future:
+        """Start a coroutine on the loop, keeping the caller's contextvars (job_trace); does not wait."""
+        done: concurrent.futures.Future = concurrent.futures.Future()
+
+        def finished(task: asyncio.Task):
+            if done.cancelled():
+                return
+            if task.cancelled():
+                done.cancel()
+            elif task.exception() is not None:
+                done.set_exception(task.exception())
+            else:
+                done.set_result(task.result())
+
+        loop = self.loop()
+
+        def start():
+            task = asyncio.ensure_future(coro)
+            task.add_done_callback(finished)
+            # The caller gave up (run() timed out): stop the task too
+            done.add_done_callback(lambda _: task.done() or loop.call_soon_threadsafe(task.cancel))
+
+        loop.call_soon_threadsafe(contextvars.copy_context().run, start)
+        return done
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop and wait for its result; cancelled if it outlasts `timeout`."""
+        done = self.spawn(coro)
+        try:
+            return done.result(timeout)
+        except concurrent.futures.TimeoutError:
+            done.cancel()
+            raise
+
+
+class PrinterPool:
+    """
+    Least-busy job placement with failover over `size` printers. Subclasses
+    set `unreachable` (raised when nothing was sent, so another printer may
+    take the job) and override `_connected`.
+    """
+
+    unreachable: Tuple[Type[Exception], ...] = ()
+
+    def __init__(self, size: int):
+        self._inflight = [0] * size
+        self._inflight_lock = threading.Lock()
+
+    def _connected(self, index: int) -> bool:
+        return False
+
+    def _least_busy(self, send_to: Callable[[int], None]):
+        """Call send_to(index) for the least busy printer, then the next ones while it raises `unreachable`."""
+        with self._inflight_lock:
+            # Fewest jobs in flight; among equals, one that is already connected
+            order = sorted(range(len(self._inflight)), key=lambda i: (self._inflight[i], not self._connected(i)))
+        for n, index in enumerate(order):
+            with self._inflight_lock:
+                self._inflight[index] += 1
+            try:
+                send_to(index)
+                return
+            except self.unreachable as e:
+                if n == len(order) - 1:
+                    raise
+                logger.warning(f"{e}; trying the next printer")
+            finally:
+                with self._inflight_lock:
+                    self._inflight[index] -= 1
@@ -0,0 +1,93 @@
+"""
+What the connected printer model can do natively.
+
+Most ESC/POS printers (the Netum and other USB/network receipt printers)
+render QR codes and 1D barcodes themselves from a few dozen bytes. Many
+budget BLE printers ignore those commands, so for them codes are sent as a
+raster instead. PRINTER_PROFILE picks the model; PRINTER_NATIVE_QR and
+PRINTER_NATIVE_BARCODE override single capabilities.
+
+Printers that take ESC 7 (heating dots, heating time, heating interval) get
+per-band heat settings from print_density; PRINTER_HEAT_CONTROL overrides.
+"""
+import os
+from typing import Dict, FrozenSet, Optional, Tuple
+
+
+def esc7_heat(max_dots: int, heat_us: int, interval_us: int) -> bytes:
+    """ESC 7: dots heated at once (multiple of 8), heating time and interval (10 us units)."""
+    return b"\x1b7" + bytes([max_dots // 8 - 1, heat_us // 10, interval_us // 10])
+
+
+# Light, medium and dense content. Dense is the usual factory setting (64 dots,
+# 800 us, 20 us), which is also restored after each job. Sparser rows can heat
+# more dots per strike with a shorter pulse, so a line takes fewer, quicker strikes.
+ESC7_HEAT_LEVELS = (
+    esc7_heat(128, 700, 20),
+    esc7_heat(96, 750, 20),
+    esc7_heat(64, 800, 20),
+)
+
+
+class PrinterProfile:
+    """Capabilities of one printer model."""
+
+    def __init__(self, name: str, native_qr: bool = True, native_barcode: bool = True,
+                 barcode_symbologies: Optional[FrozenSet[str]] = None,
+                 heat_levels: Optional[Tuple[bytes, bytes, bytes]] = None):
+        self.name = name
+        self.native_qr = native_qr
+        self.native_barcode = native_barcode
+        # None = every symbology GS k defines
+        self.barcode_symbologies = barcode_symbologies
+        # Commands for light, medium and dense content; None = leave the printer's setting alone
+        self.heat_levels = heat_levels
+
+    def supports_barcode(self, symbology: str) -> bool:
+        return self.native_barcode and (self.barcode_symbologies is None or symbology in self.barcode_symbologies)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "native_qr": self.native_qr, "native_barcode": self.native_barcode,
+                "heat_control": self.heat_levels is not None}
+
+
+PROFILES: Dict[str, PrinterProfile] = {
+    "default": PrinterProfile("default"),
+    "netum": PrinterProfile("netum", heat_levels=ESC7_HEAT_LEVELS),
+    # Cheap BLE label/receipt printers: raster only
+    "ble-generic": PrinterProfile("ble-generic", native_qr=False, native_barcode=False),
+    "raster-only": PrinterProfile("raster-only", native_qr=False, native_barcode=False),
+}
+
+
+def _env_flag(name: str) -> Optional[bool]:
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return None
+    return value in ("true", "1", "yes")
+
+
+def load_profile() -> PrinterProfile:
+    """The profile named by PRINTER_PROFILE, with any capability overrides applied."""
+    name = os.getenv("PRINTER_PROFILE", "").strip().lower()
+    if not name:
+        name = "ble-generic" if os.getenv("PRINTER_TYPE", "usb") == "ble" else "default"
+    if name not in PROFILES:
+        raise ValueError(f"Unknown PRINTER_PROFILE {name!r}; choose from: {', '.join(sorted(PROFILES))}")
+    base = PROFILES[name]
+    native_qr = _env_flag("PRINTER_NATIVE_QR")
+    native_barcode = _env_flag("PRINTER_NATIVE_BARCODE")
+    heat_control = _env_flag("PRINTER_HEAT_CONTROL")
+    heat_levels = base.heat_levels
+    if heat_control is not None:
+        heat_levels = ESC7_HEAT_LEVELS if heat_control else None
+    return PrinterProfile(
+        base.name,
+        native_qr=base.native_qr if native_qr is None else native_qr,
+        native_barcode=base.native_barcode if native_barcode is None else native_barcode,
+        barcode_symbologies=base.barcode_symbologies,
+        heat_levels=heat_levels,
+    )
+
+
+PROFILE = load_profile()
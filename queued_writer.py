@@ -0,0 +1,98 @@
+"""
+Background writer shared by the ticket archive and the job trace recorder.
+
+Web threads hand records to a bounded queue and return at once; one daemon
+thread, started on first use (after any gunicorn fork), takes whatever is
+waiting and writes it in one go. When the writer falls behind and the queue
+fills up, new records are dropped rather than slowing a print down.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedWriter:
+    """
+    Queue plus writer thread. Subclasses implement `_write(items)`, called on
+    the writer thread with up to `max_batch` queued items, and may override
+    `_setup` (run once before the thread starts) and `_writer_stopped`
+    (run on the writer thread after `close`).
+    """
+
+    max_batch = 500
+
+    def __init__(self, name: str, max_pending: int):
+        self.name = name
+        self._queue: "queue.Queue[Optional[object]]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def _setup(self):
+        pass
+
+    def _write(self, items: List[object]):
+        raise NotImplementedError
+
+    def _writer_stopped(self):
+        pass
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._setup()
+                thread = threading.Thread(target=self._writer_loop, name=self.name, daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _enqueue(self, item: object):
+        """Queue an item for the writer. Never blocks; raises queue.Full if the writer is far behind."""
+        self._ensure_started()
+        self._queue.put_nowait(item)
+
+    def _writer_loop(self):
+        while True:
+            items = [self._queue.get()]
+            # Group whatever else is waiting into the same write
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [i for i in items if i is not None]
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                logger.error(f"{self.name}: failed to write {len(batch)} item(s): {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+            if len(batch) < len(items):  # None = shutdown
+                self._writer_stopped()
+                return
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until queued items are written (used at shutdown and in tools)."""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout: float = 5.0):
+        """Write what is queued, then stop the writer thread."""
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
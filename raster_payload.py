@@ -0,0 +1,87 @@
+"""
+Pre-rasterized images sent by the client (/print with type "raster").
+
+The browser already has the image in a canvas, so it can do the resize and
+dither itself and send a packed 1-bit bitmap at the printer's width (see
+/capabilities). The server only checks it and wraps it in GS v 0, so the
+heaviest CPU work never runs on the Pi and PIL is not imported.
+
+Payload (base64, optionally as a data URL):
+    4 bytes   magic b"TPR1"
+    2 bytes   width in dots, little-endian
+    2 bytes   height in dots, little-endian
+    ...       rows of ceil(width / 8) bytes, MSB first, 1 = black
+"""
+import base64
+import binascii
+import os
+import struct
+
+from ticket_templates import raster_command
+
+RASTER_MAGIC = b"TPR1"
+_HEADER = struct.Struct("<4sHH")
+# Per used-bit count in a row's last byte: a translate table keeping only those bits
+_PADDING_MASKS = {n: bytes(b & (0xFF << (8 - n)) & 0xFF for b in range(256)) for n in range(1, 8)}
+
+# Same settings as escpos_image, read here so this path stays PIL-free
+RASTER_MAX_WIDTH = int(os.getenv("IMAGE_MAX_WIDTH", "384"))
+RASTER_MAX_HEIGHT = int(os.getenv("IMAGE_MAX_HEIGHT", "800"))
+RASTER_DITHERING = os.getenv("IMAGE_USE_DITHERING", "true").lower() in ("true", "1", "yes")
+RASTER_CONTRAST = float(os.getenv("IMAGE_CONTRAST", "1.5"))
+
+
+def client_settings() -> dict:
+    """Rendering settings for clients, so their output matches escpos_image's."""
+    return {
+        "print_width": RASTER_MAX_WIDTH,
+        "max_height": RASTER_MAX_HEIGHT,
+        "dithering": RASTER_DITHERING,
+        "contrast": RASTER_CONTRAST,
+    }
+
+
+def encode_raster(width: int, height: int, rows: bytes) -> str:
+    """Build a base64 payload from packed rows (what the frontend does in JS)."""
+    return base64.b64encode(_HEADER.pack(RASTER_MAGIC, width, height) + rows).decode("ascii")
+
+
+def decode_raster(content: str, max_width: int = None, max_height: int = None) -> bytes:
+    """
+    Validate a client raster payload and return it as a GS v 0 command.
+    Raises ValueError with a client-facing message if it is malformed.
+    """
+    if max_width is None:
+        max_width = RASTER_MAX_WIDTH
+    if max_height is None:
+        max_height = RASTER_MAX_HEIGHT
+
+    if not isinstance(content, str):
+        raise ValueError("Raster payload must be a base64 string")
+    if "," in content:
+        content = content.split(",", 1)[1]
+    try:
+        data = base64.b64decode(content, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Raster payload is not valid base64")
+    if len(data) < _HEADER.size:
+        raise ValueError("Raster payload is too short")
+
+    magic, width, height = _HEADER.unpack_from(data)
+    if magic != RASTER_MAGIC:
+        raise ValueError("Raster payload has an unknown format")
+    if not 0 < width <= max_width:
+        raise ValueError(f"Raster width must be 1-{max_width} dots")
+    if not 0 < height <= max_height:
+        raise ValueError(f"Raster height must be 1-{max_height} dots")
+
+    bytes_per_line = (width + 7) // 8
+    rows = bytearray(memoryview(data)[_HEADER.size:])
+    if len(rows) != bytes_per_line * height:
+        raise ValueError(f"Raster data should be {bytes_per_line * height} bytes for {width}x{height}")
+    if width % 8:
+        # Clear the padding bits past `width`, which would otherwise print
+        rows[bytes_per_line - 1::bytes_per_line] = rows[bytes_per_line - 1::bytes_per_line].translate(
+            _PADDING_MASKS[width % 8])
+
+    return raster_command(bytes_per_line, height, bytes(rows))
@@ -0,0 +1,127 @@
+"""
+Raster text for characters the printer's code page can't encode.
+
+Accented names, CJK and emoji would otherwise print as code-page garbage.
+Lines containing such characters are drawn to 1-bit GS v 0 raster instead:
+
+  - the font is loaded once (TEXT_FONT_PATH, else a system font with wide
+    coverage, else Pillow's built-in font)
+  - each character is rendered once into an LRU glyph atlas and blitted
+  - whole rendered rows are LRU-cached, so repeated lines (a regular's
+    name, a resent message) cost a dict lookup
+  - rows are cropped to the inked width, so no more raster bytes are sent
+    than the line needs
+
+PIL is imported on first use only, so plain-ASCII tickets never load it.
+"""
+import os
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from ticket_templates import raster_command
+
+
+TEXT_RASTER_ENABLED = os.getenv("TEXT_RASTER", "true").lower() in ("true", "1", "yes")
+TEXT_FONT_PATH = os.getenv("TEXT_FONT_PATH", "").strip()
+TEXT_FONT_SIZE = int(os.getenv("TEXT_FONT_SIZE", "24"))  # 24 px matches ESC/POS font A height
+TEXT_RASTER_WIDTH = int(os.getenv("TEXT_RASTER_WIDTH", os.getenv("IMAGE_MAX_WIDTH", "384")))
+GLYPH_CACHE_SIZE = int(os.getenv("TEXT_GLYPH_CACHE_SIZE", "2048"))
+ROW_CACHE_SIZE = int(os.getenv("TEXT_ROW_CACHE_SIZE", "256"))
+
+# Tried in order when TEXT_FONT_PATH is unset
+FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+
+@lru_cache(maxsize=1)
+def _font():
+    """Load the raster font once. Returns None if no usable font exists."""
+    from PIL import ImageFont
+
+    for path in ([TEXT_FONT_PATH] if TEXT_FONT_PATH else []) + list(FONT_CANDIDATES):
+        if path and os.path.exists(path):
+            try:
+                return ImageFont.truetype(path, TEXT_FONT_SIZE)
+            except OSError:
+                continue
+    try:
+        return ImageFont.load_default(size=TEXT_FONT_SIZE)
+    except (TypeError, OSError, ImportError):
+        return None
+
+
+def available() -> bool:
+    """True if lines can be rasterized (enabled and a font loaded)."""
+    return TEXT_RASTER_ENABLED and _font() is not None
+
+
+@lru_cache(maxsize=1)
+def _line_height() -> int:
+    ascent, descent = _font().getmetrics()
+    return ascent + descent
+
+
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def _glyph(ch: str) -> Tuple[Optional[object], int]:
+    """(1-bit ink mask or None for blank glyphs, advance in dots) for one character."""
+    from PIL import Image, ImageDraw
+
+    font = _font()
+    advance = max(1, int(round(font.getlength(ch))))
+    left, top, right, bottom = font.getbbox(ch)
+    width = max(advance, right)
+    if right <= left or bottom <= top:
+        return None, advance
+    mask = Image.new("L", (width, _line_height()), 0)
+    ImageDraw.Draw(mask).text((0, 0), ch, font=font, fill=255)
+    return mask.point(lambda v: 255 if v >= 128 else 0, mode="1"), advance
+
+
+def _wrap(text: str, max_width: int) -> List[Tuple[str, int]]:
+    """Split text into (row, inked width) pieces that fit max_width dots."""
+    rows, current, x, inked = [], [], 0, 0
+    for ch in text:
+        mask, advance = _glyph(ch)
+        if current and x + advance > max_width:
+            rows.append(("".join(current), inked))
+            current, x, inked = [], 0, 0
+        current.append(ch)
+        if mask is not None:
+            inked = max(inked, x + mask.width)
+        x += advance
+    rows.append(("".join(current), inked))
+    return rows
+
+
+def _pack_row(text: str, inked: int) -> bytes:
+    from PIL import Image
+
+    height = _line_height()
+    bytes_per_line = max(1, (min(inked, TEXT_RASTER_WIDTH) + 7) // 8)
+    row = Image.new("1", (bytes_per_line * 8, height), 0)
+    x = 0
+    for ch in text:
+        mask, advance = _glyph(ch)
+        if mask is not None:
+            row.paste(1, (x, 0), mask)
+        x += advance
+    # '1' mode packs MSB first with 1 = ink, which is what GS v 0 wants
+    return raster_command(bytes_per_line, height, row.tobytes())
+
+
+@lru_cache(maxsize=ROW_CACHE_SIZE)
+def rasterize_line(text: str) -> bytes:
+    """
+    GS v 0 raster for one line of text (wrapped to TEXT_RASTER_WIDTH).
+    Each raster block advances the paper by its own height, so no newline
+    is needed after it.
+    """
+    return b"".join(_pack_row(row, inked) for row, inked in _wrap(text, TEXT_RASTER_WIDTH))
+
+
+def cache_info() -> dict:
+    return {"glyphs": _glyph.cache_info()._asdict(), "rows": rasterize_line.cache_info()._asdict()}
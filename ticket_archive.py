@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Local ticket archive with batched background sync.
+
+Every print job is appended to a local SQLite database (WAL mode) by a
+writer thread, so archiving never adds latency to a print. A sync thread
+ships unsynced rows to ARCHIVE_SYNC_URL in gzip-compressed JSON batches,
+retrying with exponential backoff while offline; tickets printed during a
+network outage are sent once it comes back.
+
+Batch format (POST, Content-Encoding: gzip):
+    {"tickets": [{"id": 1, "created_at": "...", "route": "submit_ticket",
+                  "from_name": "...", "content": "...", ...}, ...]}
+
+A 2xx reply accepts the batch. If the endpoint stored only part of it, it
+lists the ids it could not store as {"failed": [3, 7]}; only those rows are
+sent again, so tickets already stored are not duplicated.
+
+CLI:
+    python ticket_archive.py status               # row counts
+    python ticket_archive.py stub --port 8787     # local sync endpoint for testing
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import urllib.error
+import uuid
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from queued_writer import QueuedWriter
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "true").lower() in ("true", "1", "yes")
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "ticket_archive.db")
+ARCHIVE_SYNC_URL = os.getenv("ARCHIVE_SYNC_URL", "").strip()  # Empty = keep locally only
+ARCHIVE_SYNC_TOKEN = os.getenv("ARCHIVE_SYNC_TOKEN", "").strip()  # Sent as a Bearer token if set
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_SYNC_INTERVAL_SEC = float(os.getenv("ARCHIVE_SYNC_INTERVAL_SEC", "30"))
+ARCHIVE_MAX_BACKOFF_SEC = float(os.getenv("ARCHIVE_MAX_BACKOFF_SEC", "600"))
+ARCHIVE_CLAIM_TTL_SEC = 120  # A batch claimed by a worker that died mid-sync is sent again after this
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    route TEXT NOT NULL,
+    kind TEXT,
+    from_name TEXT,
+    content TEXT,
+    has_image INTEGER NOT NULL DEFAULT 0,
+    status INTEGER,
+    duration_ms REAL,
+    synced_at TEXT,
+    sync_claim TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS tickets_unsynced ON tickets (id) WHERE synced_at IS NULL;
+"""
+
+_COLUMNS = ("created_at", "route", "kind", "from_name", "content", "has_image", "status", "duration_ms")
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # Durable across app crashes; WAL keeps commits cheap
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class TicketArchive(QueuedWriter):
+    """Append-only local archive; writes and sync happen on background threads."""
+
+    def __init__(self, path: str = ARCHIVE_DB_PATH, sync_url: str = ARCHIVE_SYNC_URL,
+                 batch_size: int = ARCHIVE_BATCH_SIZE, sync_interval: float = ARCHIVE_SYNC_INTERVAL_SEC,
+                 max_backoff: float = ARCHIVE_MAX_BACKOFF_SEC, token: str = ARCHIVE_SYNC_TOKEN,
+                 max_pending: int = 1000):
+        super().__init__("archive-writer", max_pending)
+        self.path = path
+        self.sync_url = sync_url
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.max_backoff = max_backoff
+        self.token = token
+        self._stop = threading.Event()
+        self._wake_sync = threading.Event()
+        self._sync_thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None  # Writer thread's connection
+
+    def _setup(self):
+        _connect(self.path).close()
+        if self.sync_url:
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="archive-sync", daemon=True)
+            self._sync_thread.start()
+
+    def record(self, route: str, kind: str = None, from_name: str = None, content: str = None,
+               has_image: bool = False, status: int = None, duration_ms: float = None):
+        """Queue a job for archiving; dropped with a warning if the writer is behind."""
+        try:
+            row = (datetime.now(timezone.utc).isoformat(timespec="milliseconds"), route, kind, from_name,
+                   content, int(bool(has_image)), status, duration_ms)
+            self._enqueue(row)
+        except queue.Full:
+            logger.warning("Ticket archive queue full; dropping record")
+        except Exception as e:
+            logger.warning(f"Ticket archive unavailable: {e}")
+
+    def _write(self, rows: List[tuple]):
+        if self._conn is None:
+            self._conn = _connect(self.path)
+        placeholders = ",".join("?" * len(_COLUMNS))
+        try:
+            with self._conn:
+                self._conn.executemany(f"INSERT INTO tickets ({','.join(_COLUMNS)}) VALUES ({placeholders})", rows)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to archive {len(rows)} ticket(s): {e}")
+
+    def _writer_stopped(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _sync_loop(self):
+        conn = _connect(self.path)
+        backoff = 0.0
+        while True:
+            if backoff:
+                self._stop.wait(backoff)
+            else:
+                # Rows accumulate between runs so they go out in batches
+                self._wake_sync.wait(self.sync_interval)
+                self._wake_sync.clear()
+            if self._stop.is_set():
+                break
+            try:
+                while self.sync_once(conn):
+                    pass
+                backoff = 0.0
+            except Exception as e:
+                backoff = min(self.max_backoff, max(1.0, backoff * 2)) * random.uniform(0.8, 1.2)
+                logger.info(f"Ticket sync failed ({e}); retrying in {backoff:.0f}s")
+        conn.close()
+
+    def sync_once(self, conn: sqlite3.Connection = None) -> int:
+        """Send one batch of unsynced rows. Returns how many were synced (0 = nothing left)."""
+        own = conn is None
+        if own:
+            conn = _connect(self.path)
+        try:
+            rows, claim = self._claim(conn)
+            if not rows:
+                return 0
+            # Posted outside any transaction, so inserts never wait on the network
+            try:
+                failed = self._post(rows)
+            except BaseException:
+                with conn:
+                    conn.execute("UPDATE tickets SET sync_claim = NULL WHERE sync_claim = ?", (claim,))
+                raise
+            now = datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+            with conn:
+                # Rows the endpoint could not store go back to the queue; the rest are done
+                conn.executemany("UPDATE tickets SET sync_claim = NULL WHERE sync_claim = ? AND id = ?",
+                                 [(claim, row_id) for row_id in failed])
+                conn.execute("UPDATE tickets SET synced_at = ?, sync_claim = NULL WHERE sync_claim = ?", (now, claim))
+            if failed:
+                raise RuntimeError(f"sync endpoint failed {len(failed)} of {len(rows)} ticket(s)")
+            return len(rows)
+        finally:
+            if own:
+                conn.close()
+
+    def _claim(self, conn: sqlite3.Connection):
+        """
+        Mark the next batch as being sent by this worker, in a short transaction,
+        so that with several web workers sharing one archive a batch goes out once.
+        """
+        claim = uuid.uuid4().hex
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE tickets SET sync_claim = ?, claimed_at = ? WHERE id IN ("
+                " SELECT id FROM tickets WHERE synced_at IS NULL AND (sync_claim IS NULL OR claimed_at < ?)"
+                " ORDER BY id LIMIT ?)",
+                (claim, now, now - ARCHIVE_CLAIM_TTL_SEC, self.batch_size),
+            )
+            cur = conn.execute(
+                f"SELECT id, {','.join(_COLUMNS)} FROM tickets WHERE sync_claim = ? ORDER BY id", (claim,)
+            )
+            names = [d[0] for d in cur.description]
+            rows = [dict(zip(names, r)) for r in cur.fetchall()]
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        for r in rows:
+            r["has_image"] = bool(r["has_image"])
+        return rows, claim
+
+    def _post(self, rows) -> List[int]:
+        """POST a batch. Returns the ids the endpoint reported as not stored (to send again)."""
+        body = gzip.compress(json.dumps({"tickets": rows}, separators=(",", ":")).encode("utf-8"))
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        req = urllib.request.Request(self.sync_url, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(req, timeout=15) as resp:
+            if resp.status >= 300:
+                raise RuntimeError(f"HTTP {resp.status}")
+            try:
+                failed = json.loads(resp.read() or b"{}").get("failed") or []
+            except (ValueError, AttributeError):
+                return []  # Not a JSON object: the whole batch was accepted
+        sent = {r["id"] for r in rows}
+        return [i for i in failed if isinstance(i, int) and i in sent]
+
+    def close(self, timeout: float = 5.0):
+        if not self.started:
+            return
+        super().close(timeout)
+        self._stop.set()
+        self._wake_sync.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join(timeout=timeout)
+
+    def counts(self) -> dict:
+        conn = _connect(self.path)
+        try:
+            total, unsynced = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(synced_at IS NULL), 0) FROM tickets"
+            ).fetchone()
+        finally:
+            conn.close()
+        return {"total": total, "unsynced": unsynced}
+
+
+class _NullArchive:
+    def record(self, *args, **kwargs):
+        pass
+
+    def flush(self, timeout: float = 5.0):
+        pass
+
+    def close(self):
+        pass
+
+
+def open_archive():
+    """The process-wide archive, or a no-op when ARCHIVE_ENABLED=false."""
+    if not ARCHIVE_ENABLED:
+        return _NullArchive()
+    return TicketArchive()
+
+
+# --- Local stub of the sync endpoint ---
+
+def serve_stub(port: int, fail_rate: float = 0.0):
+    """Accept gzip'd batches and log them; fail_rate simulates a flaky remote."""
+    received = {"tickets": 0, "batches": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if random.random() < fail_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            tickets = json.loads(body).get("tickets", [])
+            received["tickets"] += len(tickets)
+            received["batches"] += 1
+            print(f"batch of {len(tickets)} ({len(body)} bytes raw); total {received['tickets']} in {received['batches']} batches")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({"success": True, "stored": len(tickets)}).encode())
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Stub sync endpoint on http://127.0.0.1:{port}/ (fail rate {fail_rate:.0%})")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Show archived / unsynced counts")
+    stub = sub.add_parser("stub", help="Run a local sync endpoint")
+    stub.add_argument("--port", type=int, default=8787)
+    stub.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "status":
+        print(json.dumps(TicketArchive().counts()))
+    elif args.command == "stub":
+        serve_stub(args.port, args.fail_rate)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,291 @@
+"""
+Pre-compiled ticket layouts.
+
+A Template is compiled once into a list of ESC/POS byte segments: the
+decorative lines, banners and style commands are encoded up front, and only
+the variable fields (name, time, message, ...) are encoded per ticket. A
+render is a handful of bytes concatenations.
+
+Text is transcoded to the printer's single-byte code page (PRINTER_CODEPAGE,
+selected with ESC t) rather than sent as UTF-8, which the printer would show
+as garbage. Symbols in the static layout that the code page lacks are
+replaced with the closest ASCII in SYMBOL_FALLBACKS; user text the code page
+can't represent is rasterized line by line (see text_raster).
+"""
+import codecs
+import os
+import string
+from functools import lru_cache
+from typing import Iterator, List, NamedTuple, Union
+
+
+PRINTER_CODEPAGE = os.getenv("PRINTER_CODEPAGE", "cp437").strip().lower()
+
+# ESC t n values for the code pages common on ESC/POS printers
+CODEPAGE_TABLE = {
+    "cp437": 0,
+    "cp850": 2,
+    "cp860": 3,
+    "cp863": 4,
+    "cp865": 5,
+    "cp1252": 16,
+    "cp866": 17,
+    "cp852": 18,
+    "cp858": 19,
+}
+
+# Closest printable stand-ins for symbols missing from the code page
+SYMBOL_FALLBACKS = {
+    "✦": "*",
+    "✧": "*",
+    "★": "*",
+    "☆": "*",
+    "☽": "(",
+    "☾": ")",
+    "∴": ".",
+    "═": "=",
+    "─": "-",
+    "‘": "'",
+    "’": "'",
+    "“": '"',
+    "”": '"',
+    "–": "-",
+    "—": "-",
+    "…": "...",
+}
+
+# --- ESC/POS commands ---
+ESC = b"\x1b"
+GS = b"\x1d"
+INIT = ESC + b"@"
+ALIGN_LEFT = ESC + b"a\x00"
+ALIGN_CENTER = ESC + b"a\x01"
+BOLD_ON = ESC + b"E\x01"
+BOLD_OFF = ESC + b"E\x00"
+SIZE_NORMAL = GS + b"!\x00"
+SIZE_DOUBLE = GS + b"!\x11"
+FEED_AND_CUT = b"\n\n\n" + GS + b"V\x00"
+RASTER = GS + b"v0"  # GS v 0 m xL xH yL yH, then the bit image
+
+
+def raster_command(bytes_per_line: int, height: int, data: bytes, mode: int = 0) -> bytes:
+    """GS v 0 for `height` rows of `bytes_per_line` bytes, MSB first, 1 = black."""
+    return RASTER + bytes([mode, bytes_per_line & 0xFF, (bytes_per_line >> 8) & 0xFF,
+                           height & 0xFF, (height >> 8) & 0xFF]) + data
+
+
+class RasterBlock(NamedTuple):
+    start: int  # Offset of the GS v 0 command
+    end: int  # Offset just past its bit image
+    mode: int
+    bytes_per_line: int
+    height: int
+
+
+def raster_blocks(payload: bytes) -> Iterator[RasterBlock]:
+    """The complete GS v 0 blocks in a payload, in order; stops at a truncated one."""
+    pos = 0
+    while True:
+        start = payload.find(RASTER, pos)
+        if start < 0 or start + 8 > len(payload):
+            return
+        bytes_per_line = payload[start + 4] | payload[start + 5] << 8
+        height = payload[start + 6] | payload[start + 7] << 8
+        end = start + 8 + bytes_per_line * height
+        if end > len(payload):
+            return
+        yield RasterBlock(start, end, payload[start + 3], bytes_per_line, height)
+        pos = end
+
+
+def count_dots(data: bytes) -> int:
+    """Black dots (set bits) in raster data."""
+    return bin(int.from_bytes(data, "big")).count("1")
+
+
+def _fallback_errors(exc: UnicodeEncodeError):
+    chars = exc.object[exc.start:exc.end]
+    replacement = "".join(SYMBOL_FALLBACKS.get(ch, "?") for ch in chars)
+    try:
+        replacement.encode(exc.encoding)
+    except UnicodeEncodeError:
+        replacement = "?" * len(chars)
+    return replacement, exc.end
+
+
+codecs.register_error("ticket-fallback", _fallback_errors)
+
+
+def encode_text(text: str, codepage: str = None) -> bytes:
+    """Encode text for the printer's code page, substituting unsupported symbols."""
+    return text.encode(codepage or PRINTER_CODEPAGE, errors="ticket-fallback")
+
+
+def select_codepage(codepage: str = None) -> bytes:
+    """ESC t n for the configured code page (empty if the table doesn't know it)."""
+    n = CODEPAGE_TABLE.get(codepage or PRINTER_CODEPAGE)
+    return ESC + b"t" + bytes([n]) if n is not None else b""
+
+
+def frame(body: bytes) -> bytes:
+    """Initialize, select the code page, print body, feed and cut."""
+    return INIT + select_codepage() + body + FEED_AND_CUT
+
+
+def render_text(text: str) -> bytes:
+    """
+    Encode free text (names, messages) for the printer.
+
+    Lines the code page can represent are sent as text; lines it can't
+    (CJK, emoji, ...) are drawn to raster by text_raster, or fall back to
+    SYMBOL_FALLBACKS when raster text is unavailable.
+    """
+    try:
+        return text.encode(PRINTER_CODEPAGE)
+    except UnicodeEncodeError:
+        pass
+    import text_raster
+
+    if not text_raster.available():
+        return encode_text(text)
+    out = []
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        terminator = b"" if i == len(lines) - 1 else b"\n"
+        try:
+            out.append(line.encode(PRINTER_CODEPAGE) + terminator)
+        except UnicodeEncodeError:
+            out.append(text_raster.rasterize_line(line))  # raster advances the paper itself
+    return b"".join(out)
+
+
+class _FieldLine:
+    """One template line containing fields: pre-encoded literals plus slots."""
+
+    def __init__(self, pieces):
+        self.pieces = pieces  # [(literal bytes, field name or None), ...]
+
+    def render(self, values) -> bytes:
+        out = []
+        try:
+            for literal, field in self.pieces:
+                out.append(literal)
+                if field is not None:
+                    value = values[field]
+                    out.append(value if isinstance(value, bytes) else str(value).encode(PRINTER_CODEPAGE))
+            return b"".join(out)
+        except UnicodeEncodeError:
+            # Some value can't be encoded: render the whole line, rasterizing as needed.
+            # Literals keep their SYMBOL_FALLBACKS so the layout looks the same either way.
+            text = "".join(literal.decode(PRINTER_CODEPAGE) + ("" if field is None else str(values[field]))
+                           for literal, field in self.pieces)
+            return render_text(text)
+
+
+class Template:
+    """
+    A ticket layout compiled into static byte segments and field slots.
+
+    Parts are either str (text, with {field} placeholders as in str.format)
+    or bytes (raw ESC/POS commands). Static text is encoded once at compile
+    time (symbols outside the code page use SYMBOL_FALLBACKS, keeping text
+    tickets free of raster). At render time str field values are encoded
+    for the code page, and a line whose value can't be encoded is drawn to
+    raster via render_text, still with the fallback symbols; bytes values
+    (e.g. an image raster) are inserted as-is.
+    """
+
+    def __init__(self, *parts: Union[str, bytes]):
+        self.segments: List[Union[bytes, _FieldLine]] = []
+        self.fields = []
+        pending = bytearray()
+        for part in parts:
+            if isinstance(part, bytes):
+                pending += part
+                continue
+            for line in part.splitlines(keepends=True):
+                pieces = []
+                for literal, field, spec, conversion in string.Formatter().parse(line):
+                    if field is not None and (spec or conversion or not field.isidentifier()):
+                        raise ValueError(f"Unsupported template field: {{{field}}}")
+                    pieces.append((encode_text(literal), field))
+                    if field is not None and field not in self.fields:
+                        self.fields.append(field)
+                if all(field is None for _, field in pieces):
+                    pending += b"".join(literal for literal, _ in pieces)
+                    continue
+                if pending:
+                    self.segments.append(bytes(pending))
+                    pending = bytearray()
+                self.segments.append(_FieldLine(pieces))
+        if pending:
+            self.segments.append(bytes(pending))
+
+    def render(self, **values) -> bytes:
+        missing = [name for name in self.fields if name not in values]
+        if missing:
+            raise KeyError(f"Missing template fields: {', '.join(missing)}")
+        return b"".join(seg if isinstance(seg, bytes) else seg.render(values) for seg in self.segments)
+
+
+# --- Layouts ---
+
+PROPHECY_TICKET = Template(
+    "    .  *  .   *   .  *  .\n"
+    "  *    ✦ PROPHECY ✦    *\n"
+    "    .  *  .   *   .  *  .\n"
+    "\n"
+    "  The Oracle speaks for:\n"
+    "  ☽ {from_name}\n"
+    "  ☆ {time} on {date}\n"
+    "\n"
+    "  ═══════════════════════════\n"
+    "  The spirits whisper:\n"
+    "\n"
+    "{question}\n"
+    "\n"
+    "  ═══════════════════════════\n"
+    "    ∴ May wisdom guide you ∴\n"
+    "    .  *  .   *   .  *  .\n",
+)
+
+CLASSIC_TICKET = Template(
+    ALIGN_CENTER + SIZE_DOUBLE + BOLD_ON,
+    "================================\n"
+    "TICKET\n",
+    SIZE_NORMAL + BOLD_OFF,
+    "--------------------------------\n",
+    ALIGN_LEFT + BOLD_ON,
+    "From: {from_name}\n",
+    BOLD_OFF,
+    "Time: {time}\n"
+    "Date: {date}\n"
+    "--------------------------------\n",
+    BOLD_ON,
+    "Question/Comment\n",
+    BOLD_OFF,
+    "{question}\n",
+    "{image}",
+    "--------------------------------\n",
+    ALIGN_CENTER + SIZE_DOUBLE + BOLD_ON,
+    "================================\n",
+    SIZE_NORMAL + BOLD_OFF,
+)
+
+# Inserted into CLASSIC_TICKET's {image} slot ahead of the raster
+CLASSIC_IMAGE_HEADER = Template("--------------------------------\n", ALIGN_CENTER).render()
+
+# /print images: separator and date, then the centered raster
+IMAGE_NOTE_HEADER = Template("--------------------------------\n{date}\n\n", ALIGN_CENTER)
+
+
+@lru_cache(maxsize=None)
+def note_template(include_separator: bool = True, include_date: bool = True) -> Template:
+    """Layout for generic /print notes: optional separator and date, then content."""
+    parts = []
+    if include_separator:
+        parts.append("--------------------------------\n")
+    if include_date:
+        parts.append("{date}\n\n")
+    parts.append("{content}\n\n")
+    return Template(*parts)